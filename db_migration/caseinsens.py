@@ -9,12 +9,19 @@
 # script. If it does, execute this script in a command line using a Python
 # interpreter, passing the filename of your DB as the only argument.
 #
+# To see what the script would do without changing anything, pass --dry-run
+# (processes every account) or --analyze (processes a sample of accounts) in
+# addition to the DB filename. This also estimates how long the real run will
+# take.
+#
 # The script will create a backup of your DB, as well as a log file
 # containing a record of all the changes that were made. Make sure to
 # preserve this log file in case you need to reference it in the future.
 #
-# If something goes wrong with the first invocation, you'll need to move the
-# DB backup and log files out of the way before the script can be re-run.
+# The changes are committed in chunks. If the script gets interrupted, just
+# re-run it on the same DB and it will resume where it left off. If you want
+# to start over from scratch instead, restore the DB from the backup and
+# move the backup and log files out of the way before re-running the script.
 #
 # If all goes well, you should be able to re-run your OF server and it'll
 # complete the migration to DB version 4.
@@ -22,16 +29,13 @@
 # Do not hesitate to ask the OF developers for assistance if necessary.
 
 import sys
-import os.path
-import shutil
 import logging
 from functools import reduce
+from collections import Counter
 
-import sqlite3
+import migration
 
-LOGFILE = 'caseinsens.log'
 DELETION_TRESHOLD = 2
-DRY_RUN = False # set to True if testing the script
 
 def check_version(cur):
     cur.execute("SELECT Value FROM Meta WHERE Key = 'DatabaseVersion';")
@@ -43,8 +47,11 @@ def check_version(cur):
         sys.exit('fatal: your database is already version {}. this script is meant to clean up version 3 before it can be upgrated to 4.'.format(ver))
 
 def get_logins(cur):
-    cur.execute('SELECT Login FROM Accounts GROUP BY LOWER(Login) HAVING COUNT(*) > 1;')
-    return [x[0] for x in cur.fetchall()]
+    # (lowest AccountID, its Login) for each group of colliding logins. The ID is the
+    # checkpoint key: SQLite only folds ASCII case, so Python's str.lower() could
+    # group and order logins differently from the queries here
+    cur.execute('SELECT MIN(AccountID), Login FROM Accounts GROUP BY LOWER(Login) HAVING COUNT(*) > 1 ORDER BY MIN(AccountID);')
+    return cur.fetchall()
 
 def rate_triviality(cur, accid, accname):
     cur.execute('SELECT PlayerID, TutorialFlag, Level FROM Players WHERE AccountID = ?;', (accid,))
@@ -71,25 +78,28 @@ def rate_triviality(cur, accid, accname):
     logging.info('** {} is non-trivial'.format(accname))
     return (99, levelsum)
 
-def process_login(cur, login):
+def process_login(cur, item):
+    login = item[1]
     cur.execute('SELECT Login, AccountID FROM Accounts WHERE Login LIKE ?;', (login,))
     duplicates = cur.fetchall()
 
+    outcome = Counter(accounts=len(duplicates))
     rest = []
     for name, accid in duplicates:
         rating, levelsum = rate_triviality(cur, accid, name)
 
         if rating < DELETION_TRESHOLD:
             logging.info('* triviality for {} is {}; deleting'.format(name, rating))
-            if not DRY_RUN:
-                cur.execute('DELETE FROM Accounts WHERE AccountID = ?;', (accid,))
+            cur.execute('DELETE FROM Accounts WHERE AccountID = ?;', (accid,))
+            outcome['deleted'] += 1
         else:
             logging.info('* triviality for {} is {}, levelsum = {}; keeping'.format(name, rating, levelsum))
             rest.append((levelsum, name, accid, ))
 
     if len(rest) == 0:
         logging.warning('all variants of {} were trivial?'.format(login))
-        return
+        outcome['all_trivial'] += 1
+        return outcome
 
     # pick the account with the largest sum of character levels as primary...
     rest.sort()
@@ -109,41 +119,29 @@ def process_login(cur, login):
             newname = newname[:32]
 
         logging.info('* renaming {} to {}'.format(oldname, newname))
-        if not DRY_RUN:
-            cur.execute('UPDATE Accounts SET Login = ? WHERE AccountID = ?;', (newname, accid))
-
-def main(path):
-    if os.path.isfile(LOGFILE):
-        sys.exit('fatal: a log file named {} already exists. refusing to modify.'.format(LOGFILE))
-
-    logging.basicConfig(filename=LOGFILE, level=20, format='%(levelname)s: %(message)s')
-
-    if not os.path.isfile(path):
-        sys.exit('fatal: {} is not a file'.format(path))
-
-    bakpath = path + '.caseinsens.bak'
-
-    if os.path.isfile(bakpath):
-        sys.exit('fatal: a DB backup named {} already exists. refusing to overwrite.'.format(bakpath))
-
-    shutil.copy(path, bakpath)
-    logging.info('saved database backup to {}'.format(bakpath))
-    print('saved database backup to {}'.format(bakpath))
-
-    with sqlite3.connect(path) as db:
-        cur = db.cursor()
-
-        check_version(cur)
-
-        logins = get_logins(cur)
-
-        for login in logins:
-            process_login(cur, login)
-
-    logging.info('done.')
-    print('done.')
+        cur.execute('UPDATE Accounts SET Login = ? WHERE AccountID = ?;', (newname, accid))
+        outcome['renamed'] += 1
+
+    return outcome
+
+def summarize(outcomes, scale):
+    total = sum(outcomes, Counter())
+    est = lambda n: int(round(n * scale))
+    print('logins with case collisions: {}'.format(est(len(outcomes))))
+    print('accounts involved: {}'.format(est(total['accounts'])))
+    print('accounts to delete: {}'.format(est(total['deleted'])))
+    print('accounts to rename: {}'.format(est(total['renamed'])))
+    print('accounts to keep as-is: {}'.format(est(total['accounts'] - total['deleted'] - total['renamed'])))
+    if total['all_trivial'] > 0:
+        print('logins where every variant gets deleted: {}'.format(est(total['all_trivial'])))
+
+def main(path, dry_run=False, analyze=False, sample=migration.ANALYZE_SAMPLE):
+    if dry_run or analyze:
+        migration.analyze(path, check_version, get_logins, process_login, summarize,
+            sample=sample if analyze else None)
+    else:
+        migration.run(path, 'caseinsens', check_version, get_logins, process_login, key=lambda item: item[0])
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        sys.exit('usage: {} database.db'.format(sys.argv[0]))
-    main(sys.argv[1])
+    args = migration.parse_args('Username case collision pruning script')
+    main(args.db, args.dry_run, args.analyze, args.sample)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Common migration runner
+#
+# This module holds the boilerplate shared by the migration scripts in this
+# directory: refusing to clobber an existing log file or DB backup, making the
+# backup, checking the DB version and walking the rows that need changing.
+#
+# Work is committed in chunks. After every chunk, the key of the last
+# processed row is recorded in a MigrationCheckpoint table inside the DB
+# being migrated. If a migration gets interrupted, simply re-run the script
+# on the same DB: it will notice the checkpoint, reuse the existing log file
+# and backup, and carry on from where it left off instead of starting over.
+# The checkpoint is removed once the migration completes.
+#
+# Before touching a production DB, the scripts can also be run with --dry-run
+# or --analyze. Both work on a scratch copy of the DB and never modify the
+# original. --dry-run processes every row and reports exactly what would
+# change; --analyze only processes a random sample of rows and extrapolates.
+# Either way, the measured throughput is used to project how long the real
+# migration will take, so the maintenance window can be planned accordingly.
+#
+# Every script also takes --profile and --timings (see profiling.py in the
+# parent directory) to profile a run and report the time spent backing up,
+# fetching and updating rows.
+
+import sys
+import os.path
+import shutil
+import logging
+import json
+import random
+import tempfile
+import argparse
+from time import perf_counter
+
+import sqlite3
+
+# profiling.py is shared with the other scripts in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import profiling
+
+CHUNK_SIZE = 500 # rows processed per transaction
+ANALYZE_SAMPLE = 1000 # rows processed by --analyze
+
+def get_checkpoint(cur, name):
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'MigrationCheckpoint';")
+    if cur.fetchone() is None:
+        return None
+
+    cur.execute('SELECT LastKey FROM MigrationCheckpoint WHERE Name = ?;', (name,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+
+    # keys are stored as JSON; composite keys come back as lists
+    key = json.loads(row[0])
+    return tuple(key) if type(key) == list else key
+
+def save_checkpoint(cur, name, key):
+    cur.execute('CREATE TABLE IF NOT EXISTS MigrationCheckpoint (Name TEXT PRIMARY KEY, LastKey TEXT NOT NULL);')
+    cur.execute('INSERT OR REPLACE INTO MigrationCheckpoint (Name, LastKey) VALUES (?, ?);', (name, json.dumps(key)))
+
+def clear_checkpoint(cur, name):
+    cur.execute('DELETE FROM MigrationCheckpoint WHERE Name = ?;', (name,))
+    cur.execute('SELECT COUNT(*) FROM MigrationCheckpoint;')
+    if cur.fetchone()[0] == 0:
+        cur.execute('DROP TABLE MigrationCheckpoint;')
+
+def peek_checkpoint(path, name):
+    db = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+    try:
+        return get_checkpoint(db.cursor(), name)
+    finally:
+        db.close()
+
+def run(path, name, check_version, get_items, process_item, key=lambda x: x, chunk_size=CHUNK_SIZE):
+    """
+    Runs a migration named `name` on the DB at `path`.
+
+    get_items(cur) returns everything that needs processing and
+    process_item(cur, item) applies the change for a single item.
+    key(item) must return a unique, JSON-serializable and sortable key for
+    each item; items are processed in key order so that a checkpoint can be
+    resumed from.
+    """
+    logfile = name + '.log'
+    bakpath = path + '.' + name + '.bak'
+
+    if not os.path.isfile(path):
+        sys.exit('fatal: {} is not a file'.format(path))
+
+    checkpoint = peek_checkpoint(path, name)
+
+    if checkpoint is None:
+        if os.path.isfile(logfile):
+            sys.exit('fatal: a log file named {} already exists. refusing to modify.'.format(logfile))
+        if os.path.isfile(bakpath):
+            sys.exit('fatal: a DB backup named {} already exists. refusing to overwrite.'.format(bakpath))
+
+    logging.basicConfig(filename=logfile, level=20, format='%(levelname)s: %(message)s')
+
+    if checkpoint is None:
+        with profiling.stage('backup'):
+            shutil.copy(path, bakpath)
+        logging.info('saved database backup to {}'.format(bakpath))
+        print('saved database backup to {}'.format(bakpath))
+    else:
+        if not os.path.isfile(bakpath):
+            sys.exit('fatal: found a checkpoint for {} but no DB backup named {}. refusing to resume.'.format(name, bakpath))
+        logging.info('resuming after {}'.format(checkpoint))
+        print('resuming after {}'.format(checkpoint))
+
+    db = sqlite3.connect(path)
+    try:
+        cur = db.cursor()
+
+        check_version(cur)
+
+        with profiling.stage('fetch'):
+            items = sorted(get_items(cur), key=key)
+            if checkpoint is not None:
+                items = [x for x in items if key(x) > checkpoint]
+
+        total = len(items)
+        for start in range(0, total, chunk_size):
+            chunk = items[start:start+chunk_size]
+            with profiling.stage('update'):
+                for item in chunk:
+                    process_item(cur, item)
+
+                save_checkpoint(cur, name, key(chunk[-1]))
+                db.commit()
+            print('{}/{} done'.format(start + len(chunk), total))
+
+        if get_checkpoint(cur, name) is not None:
+            clear_checkpoint(cur, name)
+        db.commit()
+    finally:
+        db.close()
+
+    logging.info('done.')
+    print('done.')
+
+def format_duration(secs):
+    mins, secs = divmod(int(round(secs)), 60)
+    hours, mins = divmod(mins, 60)
+    return '{}h {:02}m {:02}s'.format(hours, mins, secs)
+
+def analyze(path, check_version, get_items, process_item, summarize, sample=None, chunk_size=CHUNK_SIZE):
+    """
+    Estimates the impact of a migration without modifying the DB at `path`.
+
+    The DB is copied to a scratch file next to it (which also measures how
+    long the backup step takes) and process_item(cur, item) is run on the copy
+    for every item, or for `sample` randomly chosen ones, committing in chunks
+    like run() does. summarize(outcomes, scale) receives the return values of
+    process_item and the factor to multiply sampled counts by.
+    """
+    if not os.path.isfile(path):
+        sys.exit('fatal: {} is not a file'.format(path))
+
+    # per-row log messages are not interesting here; the summary covers them
+    logging.disable(logging.CRITICAL)
+
+    scratchdir = tempfile.mkdtemp(prefix='migration-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        scratch = os.path.join(scratchdir, os.path.basename(path))
+        start = perf_counter()
+        shutil.copy(path, scratch)
+        backup_time = perf_counter() - start
+        profiling.add('backup', backup_time)
+
+        db = sqlite3.connect(scratch)
+        try:
+            cur = db.cursor()
+            check_version(cur)
+
+            start = perf_counter()
+            items = get_items(cur)
+            fetch_time = perf_counter() - start
+            profiling.add('fetch', fetch_time)
+
+            total = len(items)
+            if sample is not None and sample < total:
+                items = random.sample(items, sample)
+
+            outcomes = []
+            batch_times = []
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start+chunk_size]
+                t = perf_counter()
+                for item in chunk:
+                    outcomes.append(process_item(cur, item))
+                db.commit()
+                batch_times.append((len(chunk), perf_counter() - t))
+                profiling.add('update', batch_times[-1][1])
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(scratchdir)
+
+    processed = sum(n for n, _ in batch_times)
+    if processed < total:
+        print('analyzed a random sample of {} out of {} rows'.format(processed, total))
+    else:
+        print('analyzed all {} rows'.format(total))
+    print()
+
+    summarize(outcomes, total / processed if processed > 0 else 0)
+    print()
+
+    process_time = sum(t for _, t in batch_times)
+    print('backup: {:.2f}s, fetching rows: {:.2f}s'.format(backup_time, fetch_time))
+    if processed > 0:
+        rates = [n / t for n, t in batch_times if t > 0]
+        rate = processed / process_time if process_time > 0 else float('inf')
+        print('throughput: {:.0f} rows/s overall ({} batches of up to {} rows, slowest {:.0f} rows/s, fastest {:.0f} rows/s)'.format(
+            rate, len(batch_times), chunk_size, min(rates, default=rate), max(rates, default=rate)))
+        projected = backup_time + fetch_time + total / rate
+    else:
+        projected = backup_time + fetch_time
+    print('projected runtime: {}'.format(format_duration(projected)))
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('db', help='path to the OpenFusion database')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--dry-run', action='store_true',
+        help='process every row on a scratch copy of the DB and report what would change')
+    mode.add_argument('--analyze', action='store_true',
+        help='like --dry-run, but only process a random sample of rows and extrapolate')
+    parser.add_argument('--sample', type=int, default=ANALYZE_SAMPLE,
+        help='number of rows sampled by --analyze (default: {})'.format(ANALYZE_SAMPLE))
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start(os.path.splitext(os.path.basename(sys.argv[0]))[0], args)
+    return args
@@ -9,24 +9,29 @@
 # containing a record of all the changes that were made. Make sure to
 # preserve this log file in case you need to reference it in the future.
 #
-# If something goes wrong with the first invocation, you'll need to move the
-# DB backup and log files out of the way before the script can be re-run.
+# The changes are committed in chunks. If the script gets interrupted, just
+# re-run it on the same DB and it will resume where it left off. If you want
+# to start over from scratch instead, restore the DB from the backup and
+# move the backup and log files out of the way before re-running the script.
+#
+# To see what the script would do without changing anything, pass --dry-run
+# (processes every score) or --analyze (processes a sample of scores) in
+# addition to the DB filename. This also estimates how long the real run will
+# take.
 #
 # If all goes well, you should see different, OG-true scores in IZ scoreboards.
 #
 # Do not hesitate to ask the OF developers for assistance if necessary.
 
 import sys
-import os.path
-import shutil
 import logging
 import json
 from math import exp
+from statistics import mean, quantiles
 
-import sqlite3
+import migration
+import profiling # from the parent directory, which migration puts on the path
 
-LOGFILE = 'ogracing.log'
-DRY_RUN = False # set to True if testing the script
 CAP_SCORES = True # set to False to disable capping scores to the IZ maximum
 
 class EpData:
@@ -72,7 +77,7 @@ def load_epinfo():
 
 def get_results(cur):
     results = []
-    cur.execute('SELECT EPID, PlayerID, Timestamp, RingCount, Time, Score FROM RaceResults;')
+    cur.execute('SELECT EPID, PlayerID, Timestamp, RingCount, Time, Score FROM RaceResults ORDER BY PlayerID, Timestamp;')
     for x in cur.fetchall():
         result = RaceResult()
         result.epid = int(x[0])
@@ -84,53 +89,63 @@ def get_results(cur):
         results.append(result)
     return results
 
-def process_result(cur, result, epinfo):
+def process_result(cur, result, epinfo, quiet=False):
     epdata = epinfo[result.epid]
     pod_score = (epdata.pod_factor * result.ring_count) / epdata.max_pods
     time_score = (epdata.time_factor * result.time) / epdata.max_time
     newscore = int(exp(pod_score - time_score + epdata.scale_factor))
-    if CAP_SCORES and newscore > epdata.max_score:
+    capped = CAP_SCORES and newscore > epdata.max_score
+    if capped:
         logging.warning('score {} greater than max ({}) for epid {}, capping'.format(newscore, epdata.max_score, result.epid))
-        print('warning: score {} greater than max ({}) for epid {}, capping'.format(newscore, epdata.max_score, result.epid))
+        if not quiet:
+            print('warning: score {} greater than max ({}) for epid {}, capping'.format(newscore, epdata.max_score, result.epid))
         newscore = epdata.max_score
     logging.info('* {} -> {} (EPID: {}, pods: {}, time: {})'.format(result.score, newscore, result.epid, result.ring_count, result.time))
-    if not DRY_RUN:
-        cur.execute('UPDATE RaceResults SET Score = ? WHERE (PlayerID, Timestamp) = (?, ?);', (newscore, result.playerid, result.timestamp))
-
-def main(path):
-    if os.path.isfile(LOGFILE):
-        sys.exit('fatal: a log file named {} already exists. refusing to modify.'.format(LOGFILE))
-
-    logging.basicConfig(filename=LOGFILE, level=20, format='%(levelname)s: %(message)s')
-
-    if not os.path.isfile(path):
-        sys.exit('fatal: {} is not a file'.format(path))
-
-    bakpath = path + '.ogracing.bak'
-
-    if os.path.isfile(bakpath):
-        sys.exit('fatal: a DB backup named {} already exists. refusing to overwrite.'.format(bakpath))
-
-    shutil.copy(path, bakpath)
-    logging.info('saved database backup to {}'.format(bakpath))
-    print('saved database backup to {}'.format(bakpath))
-
-    epinfo = load_epinfo()
-
-    with sqlite3.connect(path) as db:
-        cur = db.cursor()
-
-        check_version(cur)
-
-        results = get_results(cur)
-
-        for result in results:
-            process_result(cur, result, epinfo)
-
-    logging.info('done.')
-    print('done.')
+    cur.execute('UPDATE RaceResults SET Score = ? WHERE (PlayerID, Timestamp) = (?, ?);', (newscore, result.playerid, result.timestamp))
+    return (result.playerid, result.epid, result.score, newscore, capped)
+
+def describe_scores(scores):
+    if len(scores) < 2:
+        return ', '.join(str(x) for x in scores) or '-'
+    q1, median, q3 = quantiles(scores, n=4)
+    return 'min {}, q1 {:.0f}, median {:.0f}, q3 {:.0f}, max {}, mean {:.1f}'.format(min(scores), q1, median, q3, max(scores), mean(scores))
+
+def summarize(outcomes, scale):
+    est = lambda n: int(round(n * scale))
+    changed = [x for x in outcomes if x[2] != x[3]]
+    print('scores to update: {} (of which {} change value)'.format(est(len(outcomes)), est(len(changed))))
+    players = len(set(x[0] for x in changed))
+    if scale == 1:
+        print('players affected: {}'.format(players))
+    else:
+        # distinct counts don't extrapolate linearly from a sample
+        print('players affected: at least {}'.format(players))
+    print('scores capped to the IZ maximum: {}'.format(est(sum(1 for x in outcomes if x[4]))))
+    print()
+    print('score distribution before: {}'.format(describe_scores([x[2] for x in outcomes])))
+    print('score distribution after:  {}'.format(describe_scores([x[3] for x in outcomes])))
+
+    byepid = {}
+    for x in outcomes:
+        byepid.setdefault(x[1], []).append(x)
+    for epid in sorted(byepid):
+        rows = byepid[epid]
+        print('* EPID {}: {} rows, mean {:.1f} -> {:.1f}, max {} -> {}'.format(epid, est(len(rows)),
+            mean(x[2] for x in rows), mean(x[3] for x in rows), max(x[2] for x in rows), max(x[3] for x in rows)))
+
+def main(path, dry_run=False, analyze=False, sample=migration.ANALYZE_SAMPLE):
+    with profiling.stage('parse'):
+        epinfo = load_epinfo()
+
+    if dry_run or analyze:
+        migration.analyze(path, check_version, get_results,
+            lambda cur, result: process_result(cur, result, epinfo, quiet=True),
+            summarize, sample=sample if analyze else None)
+    else:
+        migration.run(path, 'ogracing', check_version, get_results,
+            lambda cur, result: process_result(cur, result, epinfo),
+            key=lambda result: (result.playerid, result.timestamp))
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        sys.exit('usage: {} database.db'.format(sys.argv[0]))
-    main(sys.argv[1])
+    args = migration.parse_args('OG racing score conversion script')
+    main(args.db, args.dry_run, args.analyze, args.sample)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+# in-memory entry points for using dx2cg as a library
+#
+# Everything here works on strings, bytes or file-like objects and returns the
+# converted text instead of writing files, so dx2cg can be embedded in other
+# tools or fed through a pipe. Bytes are decoded as UTF-8. Invalid input
+# raises ValueError, like the rest of the converter.
+
+from .swapper import process_shader
+from .disassembler import disassemble
+
+SEPARATOR = b"\0"
+READ_SIZE = 1 << 16
+
+def read_text(source):
+    if isinstance(source, str):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source).decode("utf-8")
+    # anything else is assumed to be a file-like object, in text or binary mode
+    return read_text(source.read())
+
+def convert_shader(source):
+    """
+    Replaces the d3d9 subprograms of a ShaderLab document with HLSL/Cg.
+    Documents without any come back unchanged.
+    """
+    return process_shader(read_text(source))
+
+def convert_subprograms(source, separator="~"):
+    """
+    Translates bare d3d9 subprograms, separated by `separator`, into a single
+    CGPROGRAM block, like disassembler.py does from the command line.
+    """
+    return disassemble(read_text(source).split(separator))
+
+def iter_documents(stream, separator=SEPARATOR):
+    """
+    Yields the documents in a binary stream, as bytes, as soon as their
+    separator has been read. A trailing separator is optional.
+    """
+    buf = bytearray()
+    start = 0 # where the current document starts in buf
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        # only the new data needs searching, plus a separator split across reads
+        search = max(start, len(buf) - len(separator) + 1)
+        buf += chunk
+        while True:
+            end = buf.find(separator, search)
+            if end < 0:
+                break
+            yield bytes(buf[start:end])
+            start = search = end + len(separator)
+        # drop what was already yielded once it's most of the buffer, so
+        # compacting stays linear overall
+        if start > len(buf) // 2:
+            del buf[:start]
+            start = 0
+    if start < len(buf):
+        yield bytes(buf[start:])
+
+def convert_stream(fin, fout, separator=SEPARATOR, on_error=None):
+    """
+    Converts every separator-delimited shader document read from the binary
+    stream fin, writing each result followed by the separator to the binary
+    stream fout as soon as it is ready.
+
+    A document that fails to convert is written out as an empty document,
+    so outputs stay aligned with inputs, and on_error(index, error) is called
+    if given. Returns the number of documents and of failures.
+    """
+    count = 0
+    failed = 0
+    for doc in iter_documents(fin, separator):
+        try:
+            out = convert_shader(doc).encode("utf-8")
+        except Exception as e:
+            # a malformed document can fail anywhere in the disassembler
+            failed += 1
+            out = b""
+            if on_error is not None:
+                on_error(count, e)
+        fout.write(out + separator)
+        fout.flush()
+        count += 1
+    return (count, failed)
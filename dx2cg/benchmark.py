@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+# benchmark and regression check for the converter
+#
+# Converts every shader in the bundled corpus, timing swapper.process_shader
+# and disassembler.disassemble separately, and compares the output against the
+# golden files in corpus/golden. Any difference is printed as a diff and makes
+# the run fail, so changes to the converter can't silently alter generated Cg.
+# After an intended change to the output, rerun with --update and review the
+# golden files in the commit.
+
+import os
+import sys
+import difflib
+import argparse
+from time import perf_counter
+from . import swapper, disassembler
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+golden_dir = os.path.join(corpus_dir, "golden")
+
+def find_shaders():
+    return [f for f in sorted(os.listdir(corpus_dir)) if f.endswith(".shader")]
+
+def get_subprograms(shader):
+    # the d3d9 blocks of every program, as passed to disassemble
+    return [[shader[s:e] for s, e in swapper.find_subprograms(shader, start, end)]
+        for start, end in swapper.find_programs(shader)]
+
+def count_instructions(programs):
+    count = 0
+    for blocks in programs:
+        for block in blocks:
+            lines = [line.strip() for line in block.split('\n')[1:-1]]
+            (_, asm) = disassembler.split_header(lines)
+            # minus the opening shader profile line and the closing quote
+            count += max(0, len(asm) - 2)
+    return count
+
+def best_time(func, arg, repeat):
+    # every run starts cold, so the memoized subprograms don't skew the timings
+    best = float("inf")
+    for _ in range(repeat):
+        disassembler.clear_caches()
+        start = perf_counter()
+        result = func(arg)
+        best = min(best, perf_counter() - start)
+    return (best, result)
+
+def disassemble_all(programs):
+    return [disassembler.disassemble(blocks) for blocks in programs]
+
+def check_golden(name, output, update):
+    golden = os.path.join(golden_dir, name)
+    if update:
+        with open(golden, "w") as f:
+            f.write(output)
+        return True
+    try:
+        with open(golden, "r") as f:
+            expected = f.read()
+    except FileNotFoundError:
+        print(f"{name}: no golden file, run with --update to create it")
+        return False
+    if output == expected:
+        return True
+    diff = difflib.unified_diff(expected.splitlines(True), output.splitlines(True), f"golden/{name}", name)
+    sys.stdout.writelines(diff)
+    return False
+
+def run(repeat=5, update=False):
+    ok = True
+    total_instructions = 0
+    total_time = 0.0
+    print(f"{'file':<24} {'instrs':>6} {'process_shader':>15} {'disassemble':>12} {'instrs/s':>10}")
+    for name in find_shaders():
+        with open(os.path.join(corpus_dir, name), "r") as f:
+            shader = f.read()
+        programs = get_subprograms(shader)
+        instructions = count_instructions(programs)
+
+        (shader_time, output) = best_time(swapper.process_shader, shader, repeat)
+        (disasm_time, _) = best_time(disassemble_all, programs, repeat)
+        total_instructions += instructions
+        total_time += disasm_time
+
+        rate = f"{instructions / disasm_time:.0f}" if instructions else "-"
+        print(f"{name:<24} {instructions:>6} {shader_time * 1000:>13.2f}ms {disasm_time * 1000:>10.2f}ms {rate:>10}")
+        ok &= check_golden(name, output, update)
+
+    if total_time > 0:
+        print(f"{total_instructions} instructions translated at {total_instructions / total_time:.0f} instructions/s")
+    disassembler.clear_caches()
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the converter on the bundled corpus and checks its output against the golden files.")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="runs per file; the fastest one is reported (default: 5)")
+    parser.add_argument("--update", action="store_true", help="overwrite the golden files with the current output")
+    args = parser.parse_args()
+    if not run(max(1, args.repeat), args.update):
+        sys.exit("output differs from the golden files")
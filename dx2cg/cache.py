@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+# incremental conversion cache for batch runs
+#
+# The index is a JSON file stored at the root of the converted folder. Each
+# converted file is recorded under a key hashing its contents together with
+# the converter settings (the dx2cg sources and flags), so a file is
+# only converted again if it or the converter changed since the last run.
+
+import os
+import json
+import hashlib
+from . import disassembler
+
+INDEX_NAME = ".dx2cg_cache.json"
+INDEX_VERSION = 1
+
+def get_settings_digest():
+    h = hashlib.sha256()
+    h.update(f"legacy={disassembler.legacy}\noptimize={disassembler.optimize}\n".encode())
+    srcdir = os.path.dirname(os.path.abspath(__file__))
+    for fn in sorted(os.listdir(srcdir)):
+        if fn.endswith(".py"):
+            h.update(fn.encode())
+            with open(os.path.join(srcdir, fn), "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+class ConversionCache:
+    def __init__(self, path):
+        self.index_path = os.path.join(path, INDEX_NAME)
+        self.root = path
+        self.settings = get_settings_digest()
+        self.entries = {}
+        self.pending = {}
+        self.hits = 0
+
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        # any change to the converter invalidates everything
+        if index.get("version") == INDEX_VERSION and index.get("settings") == self.settings:
+            self.entries = index["files"]
+
+    def get_key(self, filename):
+        h = hashlib.sha256(self.settings.encode())
+        with open(filename, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def lookup(self, filename, outfile_name):
+        """Returns the cached status of a file, or None if it needs converting."""
+        name = os.path.relpath(filename, self.root)
+        entry = self.entries.get(name)
+        try:
+            st = os.stat(filename)
+            if entry is not None and (entry["size"], entry["mtime"]) == (st.st_size, st.st_mtime_ns):
+                key = entry["key"]
+            else:
+                key = self.get_key(filename)
+        except OSError:
+            # converting it will fail and report why
+            return None
+        self.pending[name] = (key, st.st_size, st.st_mtime_ns)
+
+        if entry is None or entry["key"] != key:
+            return None
+        if entry["status"] == "processed" and not os.path.isfile(outfile_name):
+            return None
+
+        self.hits += 1
+        self.update(filename, entry["status"])
+        return entry["status"]
+
+    def update(self, filename, status):
+        name = os.path.relpath(filename, self.root)
+        if name not in self.pending:
+            return
+        key, size, mtime = self.pending.pop(name)
+        if status == "failed":
+            # always retry failures
+            self.entries.pop(name, None)
+        else:
+            self.entries[name] = {"key": key, "size": size, "mtime": mtime, "status": status}
+
+    def save(self):
+        index = {"version": INDEX_VERSION, "settings": self.settings, "files": self.entries}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
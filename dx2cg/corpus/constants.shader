@@ -0,0 +1,21 @@
+Shader "FF/Constants" {
+		Program "" {
+SubProgram "d3d9 " {
+"vs_1_1
+def c0, 2.00000000, -0.50000000, 0.25000000, 4.00000000
+dcl_position v0
+mul r0.x, c0.x, -c0.y
+add r0.y, r0.x, c0.z
+mad r1, c0.x, c0.z, -c0.y
+rsq r1.y, c0.w
+mov r2, c0
+mov oPos, r0
+mov oT0, r1
+mov oT1.xy, r2.wzyx
+mov oFog, r1.y
+"
+}
+		}
+#LINE 3
+
+}
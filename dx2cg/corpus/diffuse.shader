@@ -0,0 +1,59 @@
+Shader "FF/Diffuse" {
+Properties {
+	_Color ("Main Color", Color) = (1,1,1,1)
+	_MainTex ("Base (RGB)", 2D) = "white" {}
+}
+SubShader {
+	Tags { "RenderType"="Opaque" }
+	Pass {
+		Name "BASE"
+		Program "" {
+SubProgram "d3d9 " {
+Keywords { }
+Bind "vertex" Vertex
+Bind "normal" Normal
+Bind "texcoord" TexCoord0
+Matrix 0, [glstate_matrix_mvp]
+Matrix 4, [_Object2World]
+Local 8, [_MainTex_ST]
+Local 9, [glstate_lightmodel_ambient]
+Local 10, [glstate_light0_diffuse]
+Local 11, [_ObjectSpaceLightPos0]
+"vs_1_1
+def c12, 1.00000000, 0.00000000, 0.50000000, 2.00000000
+dcl_position v0
+dcl_normal v1
+dcl_texcoord0 v2
+dp4 oPos.x, v0, c0
+dp4 oPos.y, v0, c1
+dp4 oPos.z, v0, c2
+dp4 oPos.w, v0, c3
+dp3 r0.x, v1, c11
+max r0.x, r0.x, c12.y
+mul r1, r0.x, c10
+add oD0, r1, c9
+mad oT0.xy, v2, c8, c8.zwzw
+mov oFog, c12.x
+"
+}
+SubProgram "d3d9 " {
+Keywords { }
+Local 0, [_Color]
+SetTexture [_MainTex] {2D}
+"ps_2_0
+dcl t0.xy
+dcl v0
+dcl_2d s0
+texld r0, t0, s0
+mul r0, r0, v0
+mul_pp r0, r0, c0
+mov_pp oC0, r0
+"
+}
+		}
+#LINE 40
+
+	}
+}
+Fallback "VertexLit"
+}
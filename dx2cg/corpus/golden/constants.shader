@@ -0,0 +1,59 @@
+Shader "FF/Constants" {
+					CGPROGRAM
+			#include "UnityCG.cginc"
+			#pragma exclude_renderers xbox360 ps3 gles
+			#pragma vertex vert
+			
+			struct a2v {
+				float4 vertex : POSITION;
+				float3 normal : NORMAL;
+				float4 texcoord : TEXCOORD0;
+				float4 texcoord1 : TEXCOORD1;
+				float4 tangent : TANGENT;
+				float4 color : COLOR;
+			};
+			
+			struct v2f {
+				float4 pos : SV_POSITION;
+				float4 t0 : TEXCOORD0;
+				float4 t1 : TEXCOORD1;
+				float4 t2 : TEXCOORD2;
+				float4 t3 : TEXCOORD3;
+				float fog : FOG;
+				float4 d0 : COLOR0;
+				float4 d1 : COLOR1;
+			};
+			
+			
+			
+			v2f vert(a2v vdat) {
+				float4 r0, r1, r2, r3, r4;
+				v2f o;
+			
+				// def c0, 2.00000000, -0.50000000, 0.25000000, 4.00000000
+				const float4 c0 = float4(2.00000000, -0.50000000, 0.25000000, 4.00000000);
+				// dcl_position v0
+				float4 v0 = vdat.vertex;
+				// mul r0.x, c0.x, -c0.y
+				r0.x = 1.0;
+				// add r0.y, r0.x, c0.z
+				r0.y = r0.x + 0.25000000;
+				// mad r1, c0.x, c0.z, -c0.y
+				r1.xzw = 1.0;
+				// rsq r1.y, c0.w
+				r1.y = 0.5;
+				// mov r2, c0
+				r2.zw = c0.zw;
+				// mov oPos, r0
+				o.pos = r0;
+				// mov oT0, r1
+				o.t0 = r1;
+				// mov oT1.xy, r2.wzyx
+				o.t1.xy = r2.wz;
+				// mov oFog, r1.y
+				o.fog = r1.y;
+			
+				return o;
+			}
+			ENDCG
+
@@ -0,0 +1 @@
+Shader "Plain" { SubShader { Pass { Color (1,1,1,1) } } }
@@ -0,0 +1,136 @@
+Shader "FF/Reflective Cube" {
+Properties {
+	_Shininess ("Shininess", Range (0.01, 1)) = 0.078125
+	_Cube ("Reflection", Cube) = "_Skybox" {}
+}
+SubShader {
+	Pass {
+					BindChannels {
+				Bind "vertex" Vertex
+				Bind "normal" Normal
+				Bind "texcoord" TexCoord0
+				Bind "texcoord1" TexCoord1
+				Bind "color" Color
+			}
+			CGPROGRAM
+			#include "UnityCG.cginc"
+			#pragma exclude_renderers xbox360 ps3 gles
+			#pragma multi_compile "FOG_ON" "LIGHT_ON"#pragma vertex vert
+			#pragma fragment frag
+			
+			struct a2v {
+				float4 vertex : POSITION;
+				float3 normal : NORMAL;
+				float4 texcoord : TEXCOORD0;
+				float4 texcoord1 : TEXCOORD1;
+				float4 tangent : TANGENT;
+				float4 color : COLOR;
+			};
+			
+			struct v2f {
+				float4 pos : SV_POSITION;
+				float4 t0 : TEXCOORD0;
+				float4 t1 : TEXCOORD1;
+				float4 t2 : TEXCOORD2;
+				float4 t3 : TEXCOORD3;
+				float fog : FOG;
+				float4 d0 : COLOR0;
+				float4 d1 : COLOR1;
+			};
+			
+			struct f2a {
+				float4 c0 : COLOR0;
+			};
+			
+			float _Shininess;
+			samplerCUBE _Cube;
+			
+			v2f vert(a2v vdat) {
+				float4 r0, r1, r2, r3, r4;
+				v2f o;
+			
+				// def c15, 1.00000000, -1.00000000, 0.50000000, 0.00000000
+				// dcl_position v0
+				float4 v0 = vdat.vertex;
+				// dcl_normal v1
+				float4 v1 = float4(vdat.normal, 0);
+				// dcl_texcoord0 v2
+				float4 v2 = vdat.texcoord;
+				// dcl_texcoord1 v3
+				float4 v3 = vdat.texcoord1;
+				// dcl_color v4
+				float4 v4 = vdat.color;
+				// dp4 r0.x, v0, c0
+				r0.x = dot((float4)v0, (float4)UNITY_MATRIX_MVP[0]);
+				// dp4 r0.y, v0, c1
+				r0.y = dot((float4)v0, (float4)UNITY_MATRIX_MVP[1]);
+				// dp4 r0.z, v0, c2
+				r0.z = dot((float4)v0, (float4)UNITY_MATRIX_MVP[2]);
+				// dp4 r0.w, v0, c3
+				r0.w = dot((float4)v0, (float4)UNITY_MATRIX_MVP[3]);
+				// mov oPos, r0
+				o.pos = r0;
+				// add r1.xyz, c13, -v0
+				r1.xyz = (mul(_World2Object, float4(_WorldSpaceCameraPos, 1.0f)) + -v0).xyz;
+				// dp3 r1.w, r1, r1
+				r1.w = dot((float3)r1, (float3)r1);
+				// rsq r1.w, r1.w
+				r1.w = rsqrt(r1.w);
+				// mul r1.xyz, r1, r1.w
+				r1.xyz = (r1 * r1.w).xyz;
+				// dp3 r2.x, r1, v1
+				r2.x = dot((float3)r1, (float3)v1);
+				// slt r3, r2.x, c15.w
+				// sge r4, r2.x, c15.w
+				// min r2.y, r2.x, c15.x
+				r2.y = min(r2.x, 1.00000000);
+				// frc r2, r2
+				r2.xw = (float4(r2.x - (float)floor(r2.x), r2.y - (float)floor(r2.y), r2.z - (float)floor(r2.z), r2.w - (float)floor(r2.w))).xw;
+				// rcp r2.w, r2.w
+				r2.w = (r2.w == 0.0f) ? FLT_MAX : ((r2.w == 1.0f) ? r2.w : (1 / r2.w));
+				// mad r2.xyz, v1, -r2.x, r1
+				r2.xyz = (v1 * -r2.x + r1).xyz;
+				// mov_sat r3, r2
+				r3 = clamp(r2, 0.0, 1.0);
+				// mul oD0, v4, c12.x
+				o.d0 = v4 * float4(_Shininess,0,0,1).x;
+				// mov oD1, r3
+				o.d1 = r3;
+				// mov oT0, v2
+				o.t0 = v2;
+				// mov oT1, v3
+				o.t1 = v3;
+				// dp4 oT2.x, v0, c4
+				o.t2.x = dot((float4)v0, (float4)UNITY_MATRIX_MV[0]);
+				// mov oT3, r1.yzxw
+				o.t3 = r1.yzxw;
+			
+				return o;
+			}
+			
+			f2a frag(v2f pdat) {
+				float4 r0, r1, r2, r3, r4;
+				f2a o;
+			
+				// dcl t0
+				float4 t0 = pdat.t0;
+				// dcl v0
+				float4 v0 = pdat.v0;
+				// dcl_2d s0
+				; // no operation
+				// def c0, 0.50000000, 1.00000000, 0.00000000, 0.00000000
+				// texld r0, t0, s0
+				r0.xyz = (texCUBE(_Cube, (float2)t0)).xyz;
+				// mad r0.xyz, r0, c0.x, v0
+				r0.xyz = (r0 * 0.50000000 + v0).xyz;
+				// mov r0.w, c0.y
+				r0.w = 1.00000000;
+				// mov oC0, r0
+				o.c0 = r0;
+			
+				return o;
+			}
+			ENDCG
+}
+}
+}
@@ -0,0 +1,110 @@
+Shader "FF/TrailingDecls" {
+Properties {
+	_Color ("Main Color", Color) = (1,1,1,1)
+	_MainTex ("Base (RGB)", 2D) = "white" {}
+}
+SubShader {
+	Tags { "RenderType"="Opaque" }
+	Pass {
+		Name "BASE"
+					BindChannels {
+				Bind "vertex" Vertex
+				Bind "normal" Normal
+				Bind "texcoord" TexCoord0
+			}
+			Lighting On
+			CGPROGRAM
+			#include "UnityCG.cginc"
+			#pragma exclude_renderers xbox360 ps3 gles
+			#pragma vertex vert
+			#pragma fragment frag
+			
+			struct a2v {
+				float4 vertex : POSITION;
+				float3 normal : NORMAL;
+				float4 texcoord : TEXCOORD0;
+				float4 texcoord1 : TEXCOORD1;
+				float4 tangent : TANGENT;
+				float4 color : COLOR;
+			};
+			
+			struct v2f {
+				float4 pos : SV_POSITION;
+				float4 t0 : TEXCOORD0;
+				float4 t1 : TEXCOORD1;
+				float4 t2 : TEXCOORD2;
+				float4 t3 : TEXCOORD3;
+				float fog : FOG;
+				float4 d0 : COLOR0;
+				float4 d1 : COLOR1;
+			};
+			
+			struct f2a {
+				float4 c0 : COLOR0;
+			};
+			
+			float4 _MainTex_ST;
+			float4 _Color;
+			sampler2D _MainTex;
+			
+			v2f vert(a2v vdat) {
+				float4 r0, r1, r2, r3, r4;
+				v2f o;
+			
+				// def c12, 1.00000000, 0.00000000, 0.50000000, 2.00000000
+				// dcl_position v0
+				float4 v0 = vdat.vertex;
+				// dcl_normal v1
+				float4 v1 = float4(vdat.normal, 0);
+				// dcl_texcoord0 v2
+				float4 v2 = vdat.texcoord;
+				// dp4 oPos.x, v0, c0
+				o.pos.x = dot((float4)v0, (float4)UNITY_MATRIX_MVP[0]);
+				// dp4 oPos.y, v0, c1
+				o.pos.y = dot((float4)v0, (float4)UNITY_MATRIX_MVP[1]);
+				// dp4 oPos.z, v0, c2
+				o.pos.z = dot((float4)v0, (float4)UNITY_MATRIX_MVP[2]);
+				// dp4 oPos.w, v0, c3
+				o.pos.w = dot((float4)v0, (float4)UNITY_MATRIX_MVP[3]);
+				// dp3 r0.x, v1, c11
+				r0.x = dot((float3)v1, (float3)mul(_World2Object, _WorldSpaceLightPos0));
+				// max r0.x, r0.x, c12.y
+				r0.x = max(r0.x, 0.00000000);
+				// mul r1, r0.x, c10
+				r1 = r0.x * glstate.light[0].diffuse;
+				// add oD0, r1, c9
+				o.d0 = r1 + glstate.lightmodel.ambient;
+				// mad oT0.xy, v2, c8, c8.zwzw
+				o.t0.xy = (v2 * _MainTex_ST + _MainTex_ST.zwzw).xy;
+				// mov oFog, c12.x
+				o.fog = 1.00000000;
+			
+				return o;
+			}
+			
+			f2a frag(v2f pdat) {
+				float4 r0, r1, r2, r3, r4;
+				f2a o;
+			
+				// dcl t0.xy
+				float4 t0 = pdat.t0;
+				// dcl v0
+				float4 v0 = pdat.v0;
+				// dcl_2d s0
+				; // no operation
+				// texld r0, t0, s0
+				r0 = tex2D(_MainTex, (float2)t0);
+				// mul r0, r0, v0
+				r0 = r0 * v0;
+				// mul_pp r0, r0, c0
+				r0 = r0 * _Color;
+				// mov_pp oC0, r0
+				o.c0 = r0;
+			
+				return o;
+			}
+			ENDCG
+}
+}
+Fallback "VertexLit"
+}
@@ -0,0 +1,73 @@
+Shader "FF/Reflective Cube" {
+Properties {
+	_Shininess ("Shininess", Range (0.01, 1)) = 0.078125
+	_Cube ("Reflection", Cube) = "_Skybox" {}
+}
+SubShader {
+	Pass {
+		Program "" {
+SubProgram "d3d9 " {
+Keywords { "FOG_ON" "LIGHT_ON" }
+Bind "vertex" Vertex
+Bind "normal" Normal
+Bind "texcoord" TexCoord0
+Bind "texcoord1" TexCoord1
+Bind "color" Color
+Matrix 0, [glstate_matrix_mvp]
+Matrix 4, [glstate_matrix_modelview0]
+Matrix 8, [glstate_matrix_invtrans_modelview0]
+Local 12, ([_Shininess],0,0,1)
+Local 13, [_ObjectSpaceCameraPos]
+Local 14, [glstate_matrix_texture0]
+"vs_1_1
+def c15, 1.00000000, -1.00000000, 0.50000000, 0.00000000
+dcl_position v0
+dcl_normal v1
+dcl_texcoord0 v2
+dcl_texcoord1 v3
+dcl_color v4
+dp4 r0.x, v0, c0
+dp4 r0.y, v0, c1
+dp4 r0.z, v0, c2
+dp4 r0.w, v0, c3
+mov oPos, r0
+add r1.xyz, c13, -v0
+dp3 r1.w, r1, r1
+rsq r1.w, r1.w
+mul r1.xyz, r1, r1.w
+dp3 r2.x, r1, v1
+slt r3, r2.x, c15.w
+sge r4, r2.x, c15.w
+min r2.y, r2.x, c15.x
+frc r2, r2
+rcp r2.w, r2.w
+mad r2.xyz, v1, -r2.x, r1
+mov_sat r3, r2
+mul oD0, v4, c12.x
+mov oD1, r3
+mov oT0, v2
+mov oT1, v3
+dp4 oT2.x, v0, c4
+mov oT3, r1.yzxw
+"
+}
+SubProgram "d3d9 " {
+Keywords { "FOG_ON" "LIGHT_ON" }
+SetTexture [_Cube] {CUBE}
+"ps_2_0
+dcl t0
+dcl v0
+dcl_2d s0
+def c0, 0.50000000, 1.00000000, 0.00000000, 0.00000000
+texld r0, t0, s0
+mad r0.xyz, r0, c0.x, v0
+mov r0.w, c0.y
+mov oC0, r0
+"
+}
+		}
+#LINE 77
+
+	}
+}
+}
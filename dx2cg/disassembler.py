@@ -5,8 +5,17 @@
 
 import re
 import sys
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+
+try:
+    from . import ir
+except ImportError:
+    import ir
 
 legacy = False # True for 2.6
+optimize = True # False to emit every instruction as-is, without the IR passes
+cache_size = 4096 # entries kept by each memoized step, so long-running conversions stay bounded
 
 reserved = {
     "_Time",
@@ -39,24 +48,41 @@ decls = {
     "def": "const float4 {0} = float4({1}, {2}, {3}, {4});",
 }
 
+# right-hand sides; {0}.. are the sources, texld gets the cg lookup function last
 ops = {
-    "mov": "{0} = {1};",
-    "mov_sat": "{0} = clamp({1}, 0.0, 1.0)",
-    "add": "{0} = {1} + {2};",
-    "mul": "{0} = {1} * {2};",
-    "mad": "{0} = {1} * {2} + {3};",
-    "dp4": "{0} = dot((float4){1}, (float4){2});",
-    "dp3": "{0} = dot((float3){1}, (float3){2});",
-    "min": "{0} = min({1}, {2});",
-    "max": "{0} = max({1}, {2});",
-    "rsq": "{0} = rsqrt({1});",
-    "frc": "{0} = float4({1}.x - (float)floor({1}.x), {1}.y - (float)floor({1}.y), {1}.z - (float)floor({1}.z), {1}.w - (float)floor({1}.w));",
-    "slt": "{0} = float4(({1}.x < {2}.x) ? 1.0f : 0.0f, ({1}.y < {2}.y) ? 1.0f : 0.0f, ({1}.z < {2}.z) ? 1.0f : 0.0f, ({1}.w < {2}.w) ? 1.0f : 0.0f);",
-    "sge": "{0} = float4(({1}.x >= {2}.x) ? 1.0f : 0.0f, ({1}.y >= {2}.y) ? 1.0f : 0.0f, ({1}.z >= {2}.z) ? 1.0f : 0.0f, ({1}.w >= {2}.w) ? 1.0f : 0.0f);",
-    "rcp": "{0} = ({1} == 0.0f) ? FLT_MAX : (({1} == 1.0f) ? {1} : (1 / {1}));",
-    "texld": "{0} = {3}({2}, (float2){1});",
+    "mov": "{0}",
+    "mov_sat": "clamp({0}, 0.0, 1.0)",
+    "add": "{0} + {1}",
+    "mul": "{0} * {1}",
+    "mad": "{0} * {1} + {2}",
+    "dp4": "dot((float4){0}, (float4){1})",
+    "dp3": "dot((float3){0}, (float3){1})",
+    "min": "min({0}, {1})",
+    "max": "max({0}, {1})",
+    "rsq": "rsqrt({0})",
+    "frc": "float4({0}.x - (float)floor({0}.x), {0}.y - (float)floor({0}.y), {0}.z - (float)floor({0}.z), {0}.w - (float)floor({0}.w))",
+    "slt": "float4(({0}.x < {1}.x) ? 1.0f : 0.0f, ({0}.y < {1}.y) ? 1.0f : 0.0f, ({0}.z < {1}.z) ? 1.0f : 0.0f, ({0}.w < {1}.w) ? 1.0f : 0.0f)",
+    "sge": "float4(({0}.x >= {1}.x) ? 1.0f : 0.0f, ({0}.y >= {1}.y) ? 1.0f : 0.0f, ({0}.z >= {1}.z) ? 1.0f : 0.0f, ({0}.w >= {1}.w) ? 1.0f : 0.0f)",
+    "rcp": "({0} == 0.0f) ? FLT_MAX : (({0} == 1.0f) ? {0} : (1 / {0}))",
+    "texld": "{2}({1}, (float2){0})",
 }
 
+# the templates above, bound once instead of looked up for every instruction
+decl_formatters = {code: template.format for code, template in decls.items()}
+op_formatters = {code: template.format for code, template in ops.items()}
+
+# SetTexture type => (sampler type, cg lookup function)
+texture_types = {
+    "{2D}": ("sampler2D", "tex2D"),
+    "{3D}": ("sampler3D", "tex3D"),
+    "{RECT}": ("samplerRECT", "texRECT"),
+    "{CUBE}": ("samplerCUBE", "texCUBE"),
+}
+
+keyword_pattern = re.compile("\"[\w\d]+\"")
+light_pattern = re.compile("glstate_light(\d)_([a-zA-Z]+)")
+number_pattern = re.compile("[+-]?([0-9]*[.])?[0-9]+")
+
 struct_a2v = """struct a2v {
 \tfloat4 vertex : POSITION;
 \tfloat3 normal : NORMAL;
@@ -94,7 +120,6 @@ cg_footer = """ENDCG"""
 
 vertex_func = """v2f vert(a2v vdat) {{
 \tfloat4 r0, r1, r2, r3, r4;
-\tfloat4 tmp;
 \tv2f o;
 
 {0}
@@ -105,7 +130,6 @@ vertex_func = """v2f vert(a2v vdat) {{
 
 fragment_func = """f2a frag(v2f pdat) {{
 \tfloat4 r0, r1, r2, r3, r4;
-\tfloat4 tmp;
 \tf2a o;
 
 {0}
@@ -114,24 +138,26 @@ fragment_func = """f2a frag(v2f pdat) {{
 }}
 """
 
-def process_header(prog):
+Header = namedtuple("Header", ["keywords", "loctab", "locdecl", "binds", "lighting", "samplers"])
+
+header_prefixes = ("Keywords", "Bind", "Local", "Matrix", "SetTexture")
+
+@lru_cache(maxsize=cache_size)
+def parse_header(lines, legacy):
+    # cached, so the returned header must be treated as read-only. legacy is an
+    # argument rather than the global so that it's part of the cache key
     keywords = []
     loctab = {}
     locdecl = []
     binds = []
-    i = 0
+    samplers = {}
     lighting = False
     textures = 0
-    while i < len(prog):
-        line = prog[i]
+    for line in lines:
         if line.startswith("Keywords"):
-            keywords = re.findall("\"[\w\d]+\"", line)
-            del prog[i]
-            i = i - 1
+            keywords = keyword_pattern.findall(line)
         elif line.startswith("Bind"):
             binds.append(line)
-            del prog[i]
-            i = i - 1
         elif line.startswith("Local") or line.startswith("Matrix"):
             dec = line.split(' ')
             key = int(dec[1][:-1])
@@ -151,7 +177,7 @@ def process_header(prog):
                             locdecl.append(f"float {vals[j]};")
                 val = f"float4({vals[0]},{vals[1]},{vals[2]},{vals[3]})"
             
-            lightval = re.match("glstate_light(\d)_([a-zA-Z]+)", val)
+            lightval = light_pattern.match(val)
             if lightval:
                 val = f"glstate.light[{lightval[1]}].{lightval[2]}"
                 lighting = True
@@ -181,115 +207,141 @@ def process_header(prog):
             elif dec[0] == "Matrix":
                 for offset in range(0,4):
                     loctab[f"c{key + offset}"] = f"{val}[{offset}]"
-            
-            del prog[i]
-            i = i - 1
         elif line.startswith("SetTexture"):
             dec = line.split(' ')
-            if dec[2] == "{2D}":
-                texture_type = "sampler2D"
-            elif dec[2] == "{3D}":
-                texture_type = "sampler3D"
-            elif dec[2] == "{RECT}":
-                texture_type = "samplerRECT"
-            elif dec[2] == "{CUBE}":
-                texture_type = "samplerCUBE"
-            else:
+            if dec[2] not in texture_types:
                 raise ValueError(f"Unknown texture type {dec[2]}")
+            (texture_type, cgtex_type) = texture_types[dec[2]]
             key = f"s{textures}"
             val = dec[1][1:-1]
             loctab[key] = val
             locdecl.append(f"{texture_type} {val};")
+            samplers[val] = cgtex_type
             textures = textures + 1
 
-            del prog[i]
-            i = i - 1
-        i = i + 1
-
     # print(loctab)
     
-    return (keywords, loctab, locdecl, binds, lighting)
-
-def resolve_args(args, loctab, consts):
-    for a in range(0, len(args)):
-        arg = args[a]
-        
-        neg = ""
-        if arg[0] == '-':
-            arg = arg[1:]
-            neg = "-"
-        
-        # save swizzler!
-        dot = arg.find(".")
-        if dot > -1:
-            swiz = arg[dot:]
-            arg = arg[:dot]
-        else:
-            swiz = ""
-
-        if arg[0] == 'r':
-            pass
-        elif arg[0] == 'v':
-            pass
-        elif arg[0] == 't':
-            pass
-        elif arg[0] == 'c':
-            if arg not in consts:
-                arg = loctab[arg]
-        elif arg[0] == 's':
-            arg = loctab[arg]
-        elif arg[0] == 'o':
-            arg = f"o.{arg[1:].lower()}"
-        elif re.match("[+-]?([0-9]*[.])?[0-9]+", arg):
-            pass
-        else:
-            raise ValueError(f"Unknown arg {arg}")
-        
-        args[a] = neg + arg + swiz
-
-def get_cgtex_type(name, locdecl):
-    for loc in locdecl:
-        loc = loc.split(' ')
-        if name == loc[1][:-1]:
-            if loc[0] == 'sampler2D':
-                return "tex2D"
-            elif loc[0] == 'sampler3D':
-                return "tex3D"
-            elif loc[0] == 'samplerCUBE':
-                return "texCUBE"
-            elif loc[0] == 'samplerRECT':
-                return "texRECT"
-            else:
-                raise ValueError(f"Unknown CG texture type {loc[0]}")
-    raise ValueError(f"Could not find texture {name} in locals")    
-
-def decode(code, args, locdecl):
-    if code in decls:
-        return [decls[code].format(*args)]
-    elif code in ops:
-        target = args[0]
-        if target == "o.fog":
-            return [ops[code].format(*args)]
-        
-        dot = re.search("\.[xyzw]+", target)
-        if dot:
-            swiz = target[dot.start()+1:]
-            target = target[:dot.start()]
-        else:
-            swiz = "xyzw"
-        
-        if code == "texld":
-            lines = [ops[code].format("tmp", *args[1:], get_cgtex_type(args[2], locdecl))]
-        else:
-            lines = [ops[code].format("tmp", *args[1:])]
-
-        for c in swiz:
-            lines.append(f"{target}.{c} = tmp.{c};")
-        return lines
-    else:
+    return Header(tuple(keywords), loctab, tuple(locdecl), tuple(binds), lighting, samplers)
+
+def split_header(prog):
+    # declarations can appear anywhere in the subprogram, not just before the
+    # instructions; they're all taken out and the rest is kept in order
+    header = []
+    asm = []
+    for line in prog:
+        (header if line.startswith(header_prefixes) else asm).append(line)
+    return (parse_header(tuple(header), legacy), asm)
+
+Operand = namedtuple("Operand", ["neg", "reg", "swiz"])
+
+@lru_cache(maxsize=cache_size)
+def parse_operand(arg):
+    neg = ""
+    if arg[0] == '-':
+        arg = arg[1:]
+        neg = "-"
+
+    # save swizzler!
+    dot = arg.find(".")
+    if dot > -1:
+        return Operand(neg, arg[:dot], arg[dot:])
+    return Operand(neg, arg, "")
+
+@lru_cache(maxsize=cache_size)
+def parse_instruction(instruction):
+    (code, _, args) = instruction.partition(" ")
+    operands = tuple(parse_operand(a) for a in args.split(", ")) if args else ()
+
+    pp = code.find("_pp")
+    if pp > -1:
+        code = code[:pp]
+
+    if code not in decls and code not in ops:
         raise ValueError(f"Unknown opcode {code}")
+    return (code, operands)
+
+def resolve_const(reg, loctab, consts):
+    return reg if reg in consts else loctab[reg]
+
+def resolve_sampler(reg, loctab, consts):
+    return loctab[reg]
 
-def process_asm(asm, loctab, locdecl):
+def resolve_output(reg, loctab, consts):
+    return f"o.{reg[1:].lower()}"
+
+# register type => resolver; inputs and temporaries are used as-is
+registers = {
+    'r': None,
+    'v': None,
+    't': None,
+    'c': resolve_const,
+    's': resolve_sampler,
+    'o': resolve_output,
+}
+
+def resolve_reg(reg, loctab, consts):
+    kind = reg[0]
+    if kind in registers:
+        resolver = registers[kind]
+        return reg if resolver is None else resolver(reg, loctab, consts)
+    elif number_pattern.match(reg):
+        return reg
+    raise ValueError(f"Unknown arg {reg}")
+
+def get_src_kind(reg, consts):
+    if reg[0] == 'c':
+        return "def" if reg in consts else "local"
+    elif reg[0] == 's':
+        return "sampler"
+    elif reg[0] in registers:
+        return "reg"
+    return "literal"
+
+def decode(instruction, code, operands, loctab, consts, samplers):
+    if code in decls:
+        args = [op.neg + resolve_reg(op.reg, loctab, consts) + op.swiz for op in operands]
+        if code == "def":
+            return ir.Const(instruction, code, args)
+        return ir.Decl(instruction, code, args)
+
+    dest = resolve_reg(operands[0].reg, loctab, consts)
+    mask = operands[0].swiz[1:]
+    if not mask and dest != "o.fog":
+        mask = "xyzw"
+
+    srcs = [ir.Src(op.neg, resolve_reg(op.reg, loctab, consts), op.swiz, get_src_kind(op.reg, consts)) for op in operands[1:]]
+
+    sampler = None
+    if code == "texld":
+        if srcs[1].name not in samplers:
+            raise ValueError(f"Could not find texture {srcs[1].name} in locals")
+        sampler = samplers[srcs[1].name]
+
+    return ir.Op(instruction, code, dest, mask, srcs, sampler)
+
+def emit(node):
+    if isinstance(node, ir.Decl):
+        return decl_formatters[node.code](*node.args)
+
+    rhs = op_formatters[node.code](*node.srcs, node.sampler)
+    if not node.mask:
+        # fog is a scalar output
+        return f"{node.dest} = {rhs};"
+    if node.mask == "xyzw":
+        return f"{node.dest} = {rhs};"
+
+    # write the masked components directly instead of going through a temporary
+    lhs = f"{node.dest}.{node.mask}"
+    if node.width() == 1:
+        return f"{lhs} = {rhs};"
+    if node.code == "mov":
+        src = node.srcs[0]
+        sw = src.expand()
+        swiz = "".join(sw[ir.components.index(c)] for c in node.mask)
+        return f"{lhs} = {src.neg}{src.name}.{swiz};"
+    return f"{lhs} = ({rhs}).{node.mask};"
+
+def process_asm(asm, loctab, samplers):
     shadertype = ""
     if asm[0] == "\"vs_1_1":
         shadertype = "vertex"
@@ -299,53 +351,92 @@ def process_asm(asm, loctab, locdecl):
         raise ValueError(f"Unsupported shader type: {asm[0][1:]}")
     
     consts = set()
-    translated = []
+    nodes = []
     i = 1
     while i < len(asm):
         instruction = asm[i]
         if instruction == "\"":
             break
-        
-        space = instruction.find(" ")
-        if space == -1:
-            code = instruction
-            args = []
-        else:
-            code = instruction[:space]
-            args = instruction[space+1:].split(", ")
 
+        (code, operands) = parse_instruction(instruction)
         if code == "def":
-            consts.add(args[0])
+            consts.add(operands[0].reg)
 
-        pp = code.find("_pp")
-        if pp > -1:
-            code = code[:pp]
-            
-        resolve_args(args, loctab, consts)
-        disasm = decode(code, args, locdecl)
-        # print(f"{instruction} \t==>\t{disasm}")
-        disasm.insert(0, f"// {instruction}")
-        translated.extend(disasm)
+        nodes.append(decode(instruction, code, operands, loctab, consts, samplers))
         i = i + 1
+
+    if optimize:
+        ir.optimize(nodes)
+
+    translated = []
+    for node in nodes:
+        translated.append(f"// {node.instruction}")
+        if not node.dead:
+            translated.append(emit(node))
     
     return (shadertype, translated)
 
+class SubprogramCache:
+    """
+    Memoizes translated subprograms by their text and the settings they were
+    translated with, since the same d3d9 subprogram tends to show up in many
+    keyword variants and shader files. Only the most recently used `size`
+    subprograms are kept.
+    """
+    def __init__(self, size=cache_size):
+        self.entries = OrderedDict()
+        self.size = size
+        self.lookups = 0
+        self.translated = 0
+
+    def translate(self, block):
+        # drop the SubProgram line and closing bracket, and any stray whitespace
+        lines = tuple(line.strip() for line in block.split('\n')[1:-1])
+        key = (lines, legacy, optimize)
+        self.lookups += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            (header, asm) = split_header(lines)
+            (shadertype, disasm) = process_asm(asm, header.loctab, header.samplers)
+            entry = (header, shadertype, disasm)
+            self.entries[key] = entry
+            self.translated += 1
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def stats(self):
+        # (subprograms seen, subprograms actually translated)
+        return (self.lookups, self.translated)
+
+    def clear(self):
+        self.entries.clear()
+        self.lookups = 0
+        self.translated = 0
+
+subprogram_cache = SubprogramCache()
+
+def clear_caches():
+    subprogram_cache.clear()
+    parse_header.cache_clear()
+    parse_instruction.cache_clear()
+    parse_operand.cache_clear()
+
 def disassemble(blocks):
     shaders = {}
-    keywords = set()
-    locdecl = set()
-    binds = set()
+    # dicts rather than sets, so the output follows the input order
+    keywords = {}
+    locdecl = {}
+    binds = {}
     lighting = False
     for block in blocks:
-        asm = block.split('\n')[1:-1]
-
-        (kw, ltab, ldecl, bds, light) = process_header(asm)
-        keywords.update(kw)
-        locdecl.update(ldecl)
-        binds.update(bds)
-        lighting |= light
-
-        (shadertype, disasm) = process_asm(asm, ltab, locdecl)
+        (header, shadertype, disasm) = subprogram_cache.translate(block)
+        keywords.update(dict.fromkeys(header.keywords))
+        locdecl.update(dict.fromkeys(header.locdecl))
+        binds.update(dict.fromkeys(header.binds))
+        lighting |= header.lighting
         shaders[shadertype] = disasm
 
     text = ""
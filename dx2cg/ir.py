@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+# intermediate representation and optimization passes for translated d3d9 asm
+#
+# process_asm turns every instruction into one of the nodes below. The passes
+# work on the list of nodes in place, and the disassembler emits Cg from what
+# is left of it.
+
+import math
+
+components = "xyzw"
+
+# ops where component c of the result only depends on component c of the sources
+componentwise_ops = {"mov", "mov_sat", "add", "mul", "mad", "min", "max", "rsq", "rcp"}
+# ops that produce a single value, splatted across the write mask
+scalar_ops = {"dp3", "dp4"}
+# ops whose templates swizzle their sources, so literals can't be substituted in
+swizzling_ops = {"frc", "slt", "sge", "texld"}
+
+class Src:
+    """A resolved source operand. kind is one of reg, def, local, literal or sampler."""
+    def __init__(self, neg, name, swiz, kind):
+        self.neg = neg
+        self.name = name
+        self.swiz = swiz
+        self.kind = kind
+
+    def __str__(self):
+        return self.neg + self.name + self.swiz
+
+    def expand(self):
+        # d3d9 replicates the last component of short swizzles
+        sw = self.swiz[1:]
+        if not sw:
+            return components
+        return sw + sw[-1] * (4 - len(sw))
+
+    def width(self):
+        if self.kind == "literal":
+            return 1
+        return len(self.swiz) - 1 if self.swiz else 4
+
+class Node:
+    def __init__(self, instruction):
+        self.instruction = instruction
+        self.dead = False
+
+class Decl(Node):
+    """An input or sampler declaration, emitted as-is."""
+    def __init__(self, instruction, code, args):
+        super().__init__(instruction)
+        self.code = code
+        self.args = args
+
+class Const(Decl):
+    """A def'd constant register."""
+    def __init__(self, instruction, code, args):
+        super().__init__(instruction, code, args)
+        self.reg = args[0]
+        self.values = args[1:5]
+
+class Op(Node):
+    """An ALU or texture instruction writing the components in mask of dest."""
+    def __init__(self, instruction, code, dest, mask, srcs, sampler=None):
+        super().__init__(instruction)
+        self.code = code
+        self.dest = dest
+        self.mask = mask
+        self.srcs = srcs
+        self.sampler = sampler
+
+    def width(self):
+        if self.code in scalar_ops:
+            return 1
+        if self.code in swizzling_ops:
+            return 4
+        return max(src.width() for src in self.srcs)
+
+    def reads(self):
+        # (register, component) pairs of temporaries this instruction reads
+        for src in self.srcs:
+            if src.kind != "reg" or src.name[0] != 'r':
+                continue
+            sw = src.expand()
+            if self.code in componentwise_ops:
+                used = {sw[components.index(c)] for c in (self.mask or "x")}
+            elif self.code == "dp3":
+                used = set(sw[:3])
+            else:
+                used = set(sw)
+            for c in used:
+                yield (src.name, c)
+
+def negate_literal(text):
+    return text[1:] if text.startswith("-") else "-" + text
+
+def fold_op(code, vals):
+    if code == "mov_sat":
+        return min(max(vals[0], 0.0), 1.0)
+    elif code == "add":
+        return vals[0] + vals[1]
+    elif code == "mul":
+        return vals[0] * vals[1]
+    elif code == "mad":
+        return vals[0] * vals[1] + vals[2]
+    elif code == "min":
+        return min(vals)
+    elif code == "max":
+        return max(vals)
+    elif code == "rsq" and vals[0] > 0:
+        return 1 / math.sqrt(vals[0])
+    elif code == "rcp" and vals[0] != 0:
+        return 1 / vals[0]
+    return None
+
+def fold_constants(nodes):
+    """
+    Replaces reads of def'd constants that select a single value with that
+    value, and evaluates instructions whose sources are all literals.
+    """
+    consts = {node.reg: node.values for node in nodes if isinstance(node, Const)}
+    for node in nodes:
+        if not isinstance(node, Op):
+            continue
+        for src in node.srcs:
+            if src.kind != "def":
+                continue
+            vals = {float(consts[src.name][components.index(c)]) for c in src.expand()}
+            if node.code in swizzling_ops or len(vals) != 1:
+                continue
+            text = consts[src.name][components.index(src.expand()[0])]
+            src.name = negate_literal(text) if src.neg else text
+            src.neg = ""
+            src.swiz = ""
+            src.kind = "literal"
+
+        if node.code != "mov" and all(src.kind == "literal" for src in node.srcs):
+            val = fold_op(node.code, [float(src.name) for src in node.srcs])
+            if val is not None and math.isfinite(val):
+                node.code = "mov"
+                node.srcs = [Src("", repr(val), "", "literal")]
+
+def eliminate_dead_writes(nodes):
+    """
+    Walks the instructions backwards, dropping components written to
+    temporaries that are never read afterwards, and instructions that are
+    left with nothing to write.
+    """
+    live = set()
+    for node in reversed(nodes):
+        if not isinstance(node, Op) or node.dead:
+            continue
+        if node.dest[0] == 'r':
+            mask = "".join(c for c in node.mask if (node.dest, c) in live)
+            if not mask:
+                node.dead = True
+                continue
+            live.difference_update((node.dest, c) for c in mask)
+            node.mask = mask
+        live.update(node.reads())
+
+def eliminate_unused_consts(nodes):
+    used = {src.name for node in nodes if isinstance(node, Op) and not node.dead
+        for src in node.srcs if src.kind == "def"}
+    for node in nodes:
+        if isinstance(node, Const) and node.reg not in used:
+            node.dead = True
+
+def optimize(nodes):
+    fold_constants(nodes)
+    eliminate_dead_writes(nodes)
+    eliminate_unused_consts(nodes)
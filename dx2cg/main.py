@@ -3,35 +3,149 @@
 
 import os
 import sys
+import codecs
+import argparse
+from collections import namedtuple
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from .swapper import process
+from .disassembler import subprogram_cache
+from .cache import ConversionCache, INDEX_NAME
+from .api import convert_stream
 
-def process_file(filename, suffix):
+# profiling.py is shared with the other scripts in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import profiling
+
+# subprograms/translated count the d3d9 subprograms found in the file, and
+# how many of them weren't already translated earlier in the same process.
+# stages holds the stage timings of a worker process, for the parent to merge.
+Result = namedtuple("Result", ["filename", "status", "error", "subprograms", "translated", "stages"])
+
+def get_outfile_name(filename, suffix):
     dot = filename.rfind(".")
     if dot > -1:
-        outfile_name = filename[:dot] + suffix + filename[dot:]
+        return filename[:dot] + suffix + filename[dot:]
     else:
-        outfile_name = filename + suffix
-    return process(filename, outfile_name)
-
-def process_batch(path, suffix="_hlsl"):
-    files = os.listdir(path)
-    for f in files:
-        if os.path.isdir(f):
-            process_batch(f"{path}/{f}")
+        return filename + suffix
+
+def process_file(filename, suffix):
+    return process(filename, get_outfile_name(filename, suffix))
+
+def find_files(path):
+    files = []
+    for f in sorted(os.listdir(path)):
+        fullpath = f"{path}/{f}"
+        if os.path.isdir(fullpath):
+            files.extend(find_files(fullpath))
+        elif f != INDEX_NAME:
+            files.append(fullpath)
+    return files
+
+def convert_file(filename, suffix):
+    # runs in the worker processes, so errors are reported back instead of raised
+    (lookups, translated) = subprogram_cache.stats()
+    try:
+        with profiling.stage("disassemble"):
+            status = "processed" if process_file(filename, suffix) else "skipped"
+        err = None
+    except Exception as e:
+        # any malformed file fails on its own, like a document in convert_stream
+        status = "failed"
+        err = f"{type(e).__name__}: {e}"
+    (new_lookups, new_translated) = subprogram_cache.stats()
+    return Result(filename, status, err, new_lookups - lookups, new_translated - translated, None)
+
+def convert_file_in_worker(filename, suffix):
+    # the stages timed in the worker go back with the result, since its own
+    # timers are never reported
+    result = convert_file(filename, suffix)
+    return result._replace(stages=profiling.take_stages())
+
+def report(path, results):
+    counts = {"processed": 0, "skipped": 0, "failed": 0, "cached": 0, "subprograms": 0, "translated": 0}
+    for filename, status, err, subprograms, translated, stages in results:
+        f = os.path.relpath(filename, path)
+        if status == "processed":
+            print(f"Processed {f}")
+        elif status == "skipped":
+            print(f"Skipping {f}")
+        elif status == "failed":
+            print(f"Failed to process {f}: {err}")
+        counts[status] += 1
+        counts["subprograms"] += subprograms
+        counts["translated"] += translated
+        if stages is not None:
+            profiling.merge(stages)
+    print(f"{counts['processed']} processed, {counts['skipped']} skipped, {counts['failed']} failed, {counts['cached']} unchanged")
+    print(f"{counts['subprograms']} d3d9 subprograms, {counts['translated']} unique ones translated")
+    return counts
+
+def merge_results(files, cached, converted, cache):
+    # yields results in file order, pulling from the conversions as needed
+    for filename in files:
+        if filename in cached:
+            yield Result(filename, "cached", None, 0, 0, None)
         else:
-            try:
-                if process_file(f"{path}/{f}", suffix):
-                    print(f"Processed {f}")
-                else:
-                    print(f"Skipping {f}")
-            except ValueError as err:
-                print(f"Failed to process {f}: {err}")
+            result = next(converted)
+            if cache is not None:
+                cache.update(filename, result.status)
+            yield result
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: main.py <folder> [outfile-suffix]")
-    elif len(sys.argv) == 2:
-        process_batch(sys.argv[1])
-    else:
-        process_batch(*sys.argv[1:3])
+def process_batch(path, suffix="_hlsl", jobs=1, use_cache=True):
+    with profiling.stage("scan"):
+        files = find_files(path)
+
+        cache = ConversionCache(path) if use_cache else None
+        cached = set()
+        if cache is not None:
+            for f in files:
+                if cache.lookup(f, get_outfile_name(f, suffix)) is not None:
+                    cached.add(f)
+    todo = [f for f in files if f not in cached]
 
+    try:
+        if jobs == 1:
+            converted = map(convert_file, todo, repeat(suffix))
+            return report(path, merge_results(files, cached, converted, cache))
+
+        # jobs=None uses every core; results still come back in file order
+        workers = jobs or os.cpu_count()
+        chunksize = max(1, len(todo) // (workers * 4))
+        # forked workers start with a copy of this process's timers, which are dropped
+        with ProcessPoolExecutor(max_workers=workers, initializer=profiling.take_stages) as executor:
+            converted = executor.map(convert_file_in_worker, todo, repeat(suffix), chunksize=chunksize)
+            return report(path, merge_results(files, cached, converted, cache))
+    finally:
+        if cache is not None:
+            with profiling.stage("cache save"):
+                cache.save()
+
+def process_stdin(separator):
+    # shader documents in, converted documents out, in the same order
+    def on_error(index, err):
+        print(f"Failed to process document {index}: {err}", file=sys.stderr)
+    with profiling.stage("disassemble"):
+        (count, failed) = convert_stream(sys.stdin.buffer, sys.stdout.buffer, separator, on_error)
+    print(f"{count - failed} processed, {failed} failed", file=sys.stderr)
+    return failed == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts the d3d9 subprograms of every shader in a folder to HLSL/Cg.")
+    parser.add_argument("folder", nargs="?")
+    parser.add_argument("suffix", nargs="?", default="_hlsl", help="appended to the name of converted files (default: _hlsl)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes; 0 uses every core (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help=f"convert every file, ignoring and not updating {INDEX_NAME}")
+    parser.add_argument("--stdin", action="store_true", help="convert shader documents read from stdin and write them to stdout instead of converting a folder")
+    parser.add_argument("--separator", default="\\0", help="separator between documents with --stdin, with backslash escapes (default: \\0)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start("dx2cg", args)
+    if args.stdin:
+        separator = codecs.decode(args.separator, "unicode_escape").encode("utf-8")
+        if not separator:
+            parser.error("the separator can't be empty")
+        sys.exit(0 if process_stdin(separator) else 1)
+    if args.folder is None:
+        parser.error("a folder is required unless --stdin is given")
+    process_batch(args.folder, args.suffix, args.jobs or None, not args.no_cache)
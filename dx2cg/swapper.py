@@ -14,51 +14,65 @@ def indent(block):
         lines[i] = tabs * "\t" + lines[i]
     return "\n".join(lines)
 
-def find_closing_bracket(block, i):
+program_start = "Program \"\""
+subprogram_start = "SubProgram \"d3d9"
+line_marker = re.compile("#LINE [0-9]+\n")
+bracket = re.compile("[{}]")
+
+def find_closing_bracket(block, i, end=None):
     count = 0
-    while i < len(block):
-        if block[i] == '{':
+    for m in bracket.finditer(block, i, len(block) if end is None else end):
+        if m.group() == '{':
             count = count + 1
-        if block[i] == '}':
+        else:
             count = count - 1
             if count == 0:
-                return i
-        i = i + 1
+                return m.start()
     raise ValueError(f"Block at {i} has no closing bracket")
 
-def process_program(prog):
-    # print("processing:\n" + prog)
-    subprogs = []
-    subprog_index = prog.find("SubProgram \"d3d9")
+def find_subprograms(buf, start=0, end=None):
+    # (start, end) offsets of every d3d9 subprogram between start and end
+    if end is None:
+        end = len(buf)
+    spans = []
+    subprog_index = buf.find(subprogram_start, start, end)
     while subprog_index > -1:
-        subprog_end_index = find_closing_bracket(prog, subprog_index)
-        subprog = prog[subprog_index:subprog_end_index+1]
-        subprogs.append(subprog)
-        prog = prog[subprog_end_index+1:]
-        subprog_index = prog.find("SubProgram \"d3d9")
+        subprog_end_index = find_closing_bracket(buf, subprog_index, end) + 1
+        spans.append((subprog_index, subprog_end_index))
+        subprog_index = buf.find(subprogram_start, subprog_end_index, end)
+    return spans
+
+def find_programs(buf):
+    # (start, end) offsets of every program section, up to just past its #LINE marker
+    spans = []
+    program_index = buf.find(program_start)
+    while program_index > -1:
+        line = line_marker.search(buf, program_index)
+        if not line:
+            raise ValueError(f"Program at {program_index} has no #LINE marker")
+        end_index = min(line.end() + 2, len(buf))
+        spans.append((program_index, end_index))
+        program_index = buf.find(program_start, end_index)
+    return spans
+
+def process_program(prog, start=0, end=None):
+    # print("processing:\n" + prog[start:end])
+    subprogs = [prog[s:e] for s, e in find_subprograms(prog, start, end)]
     if len(subprogs) < 1:
         raise ValueError(f"Program has no d3d9 subprograms")
     processed = disassemble(subprogs) + "\n"
     return indent(processed)
 
 def process_shader(shader):
-    buf = shader
-    processed = ''
-    program_index = buf.find("Program \"\"")
-    while program_index > -1:
-        processed = processed + buf[:program_index]
-        buf = buf[program_index:]
-        line = re.search("#LINE [0-9]+\n", buf)
-        if not line:
-            raise ValueError(f"Program at {program_index} has no #LINE marker")
-        end_index = line.end() + 1
-        program_section = buf[:end_index+1]
-        processed = processed + process_program(program_section)
-        buf = buf[end_index+1:]
-        
-        program_index = buf.find("Program \"\"")
-    processed = processed + buf
-    return processed
+    # the output is assembled from slices of the original buffer in a single join
+    parts = []
+    last = 0
+    for start, end in find_programs(shader):
+        parts.append(shader[last:start])
+        parts.append(process_program(shader, start, end))
+        last = end
+    parts.append(shader[last:])
+    return "".join(parts)
 
 def process(fn_in, fn_out):
     with open(fn_in, "r") as fi:
@@ -1,8 +1,19 @@
 # %%
+import os
 import json
 import sys
+import argparse
+from time import perf_counter
+from contextlib import contextmanager
 from tqdm import tqdm
-import mysql.connector
+import rowcache
+
+# schema/ and mappings.json are next to this file
+here = os.path.dirname(os.path.abspath(__file__))
+
+# profiling.py is shared with the other scripts in the parent directory
+sys.path.insert(0, os.path.join(here, ".."))
+import profiling
 
 SPLIT_FIELDS = {
     "m_iMissionRewardItem": ("m_iMissionRewardItemID", "m_iMissionRewarItemType"),
@@ -15,6 +26,37 @@ SPLIT_FIELDS = {
     "m_iFItem": ("m_iFItemID", "m_iFItemNumNeeded"),
 }
 
+# columns that rows are looked up by, indexed in the DB
+NATURAL_KEYS = {
+    "NpcTable": ("NpcNumber",),
+    "MissionField": ("HMissionID",),
+    "Reward": ("MissionRewardID",),
+    "NanoTable": ("NanoNumber",),
+    "NanoTuneTable": ("TuneNumber",),
+    "SkillTable": ("SkillNumber",),
+    "ClassSkill_Skill": ("SkillNumber",),
+    "ShinyTable": ("ShinyID",),
+    "VendorTable": ("NpcNumber",),
+    "WarpTable": ("WarpNumber",),
+    "TransportationTable": ("VehicleID",),
+    "XComTable": ("XcomNumber",),
+    "CutSceneText": ("Event",),
+    "ItemWpnTable": ("ItemNumber",),
+    "ItemShirtTable": ("ItemNumber",),
+    "ItemPantsTable": ("ItemNumber",),
+    "ItemShoesTable": ("ItemNumber",),
+    "ItemHatTable": ("ItemNumber",),
+    "ItemGlassTable": ("ItemNumber",),
+    "ItemBackTable": ("ItemNumber",),
+    "ItemGeneralTable": ("ItemNumber",),
+    "ItemQuestTable": ("ItemNumber",),
+    "ItemChestTable": ("ItemNumber",),
+    "ItemVehicleTable": ("ItemNumber",),
+    "ItemFaceTable": ("ItemNumber",),
+    "ItemHeadTable": ("ItemNumber",),
+    "ItemSkillBookTable": ("ItemNumber",),
+}
+
 # %%
 def get_db_column_name(xdt_field_name):
     # special case 1
@@ -120,22 +162,26 @@ def table_create(cursor, table_name, xdt_template_entry):
     sql += ")"
     cursor.execute(sql)
 
+def table_create_indexes(cursor, table_name):
+    # a single ALTER builds every index in one pass over the data
+    db_field_names = NATURAL_KEYS.get(table_name, ())
+    if len(db_field_names) > 0:
+        cursor.execute(f"ALTER TABLE {table_name} " + ", ".join(f"ADD INDEX (`{name}`)" for name in db_field_names))
+
 # %%
-def table_populate(cursor, table_name, table_entries):
+def table_populate(cursor, table_name, field_names, vals):
     # generate the SQL first
     sql = f"INSERT INTO {table_name} ("
-    template_entry = table_entries[0]
-    for field_name in template_entry:
+    for field_name in field_names:
         db_field_name = get_db_column_name(field_name)
         sql += f"`{db_field_name}`,"
     sql = sql[:-1] # remove trailing comma
     sql += ") VALUES ("
-    for field_name in template_entry:
+    for field_name in field_names:
         sql += f"%s,"
     sql = sql[:-1] # remove trailing comma
     sql += ")"
     
-    vals = [table_entry_to_tuple(entry) for entry in table_entries]
     try:
         cursor.executemany(sql, vals)
     except Exception as e:
@@ -144,45 +190,131 @@ def table_populate(cursor, table_name, table_entries):
         raise e
 
 # %%
-def process_xdt_table(cursor, root, table_name, mappings):
+def process_xdt_table(root, table_name, mappings):
+    # returns (DB table name, field names, rows) for each subtable
+    tables = []
     table = root[table_name]
     for subtable_name in tqdm(table, desc=table_name, total=len(table)):
         if subtable_name not in mappings[table_name]:
             print(f"No mapping found for {table_name}.{subtable_name}")
             raise Exception()
         db_table_name = mappings[table_name][subtable_name]
-        with open(f"schema/{db_table_name}.json", 'r') as f:
+        with open(os.path.join(here, "schema", f"{db_table_name}.json"), 'r') as f:
             schema = json.load(f)
         #print(f"{subtable_name} => {db_table_name}")
         
-        table_entries = table[subtable_name]
-        if db_table_name == "CutSceneText":
-            table_entries = handle_dict_table(table_entries, "m_iEvent", "m_TextElement")
-        table_entries = [apply_schema(schema, entry) for entry in table_entries]
-        table_entries = [flatten_table_entry(entry) for entry in table_entries]
+        with profiling.stage("transform"):
+            table_entries = table[subtable_name]
+            if db_table_name == "CutSceneText":
+                table_entries = handle_dict_table(table_entries, "m_iEvent", "m_TextElement")
+            table_entries = [apply_schema(schema, entry) for entry in table_entries]
+            table_entries = [flatten_table_entry(entry) for entry in table_entries]
+
+            field_names = list(table_entries[0])
+            vals = [table_entry_to_tuple(entry) for entry in table_entries]
+        tables.append((db_table_name, field_names, vals))
+    return tables
+
+@profiling.stage("insert")
+def upload_table(cursor, db_table_name, field_names, vals, bulk=False):
+    template_entry = dict(zip(field_names, vals[0]))
+    start = perf_counter()
+
+    # clear the table
+    drop_sql = f"DROP TABLE IF EXISTS {db_table_name}"
+    cursor.execute(drop_sql)
+
+    # create the table
+    table_create(cursor, db_table_name, template_entry)
+    if bulk:
+        # load the rows in one transaction
+        cursor.execute("START TRANSACTION")
+        table_populate(cursor, db_table_name, field_names, vals)
+        cursor.execute("COMMIT")
+    else:
+        table_populate(cursor, db_table_name, field_names, vals)
+
+    # the secondary indexes are built over the finished table, instead of
+    # being maintained row by row
+    with profiling.stage("index"):
+        table_create_indexes(cursor, db_table_name)
 
-        # clear the table
-        drop_sql = f"DROP TABLE IF EXISTS {db_table_name}"
-        cursor.execute(drop_sql)
+    return (db_table_name, len(vals), perf_counter() - start)
 
-        # create the table
-        table_create(cursor, db_table_name, table_entries[0])
-        table_populate(cursor, db_table_name, table_entries)
+# %%
+@contextmanager
+def bulk_load_session(cursor):
+    # checks are off for the whole load; the previous settings are restored after
+    cursor.execute("SELECT @@session.autocommit, @@session.unique_checks, @@session.foreign_key_checks")
+    autocommit, unique_checks, foreign_key_checks = cursor.fetchone()
+    cursor.execute("SET autocommit = 0, unique_checks = 0, foreign_key_checks = 0")
+    try:
+        yield
+    finally:
+        cursor.execute(f"SET autocommit = {int(autocommit)}, unique_checks = {int(unique_checks)}, foreign_key_checks = {int(foreign_key_checks)}")
+
+def print_stats(stats):
+    total_rows = 0
+    total_secs = 0
+    for db_table_name, rows, secs in stats:
+        rate = rows / secs if secs > 0 else 0
+        print(f"{db_table_name:<32} {rows:>8} rows {secs:>8.2f}s {rate:>10.0f} rows/s")
+        total_rows += rows
+        total_secs += secs
+    if total_secs > 0:
+        print(f"{'total':<32} {total_rows:>8} rows {total_secs:>8.2f}s {total_rows / total_secs:>10.0f} rows/s")
 
 # %%
-def main(conn, xdt_path):
-    with open("mappings.json", 'r') as f:
-        mappings = json.load(f)
-    with open(xdt_path, 'r') as f:
+def process_xdt(xdt_path, mappings):
+    with profiling.stage("parse"), open(xdt_path, 'r') as f:
         root = json.load(f)
-    cursor = conn.cursor()
+    tables = []
     for table_name in root:
         if "Table" in table_name:
-            process_xdt_table(cursor, root, table_name, mappings)
+            tables += process_xdt_table(root, table_name, mappings)
+    return tables
+
+def load_mappings():
+    with open(os.path.join(here, "mappings.json"), 'r') as f:
+        return json.load(f)
+
+def get_tables(xdt_path, mappings, use_cache=True):
+    # the cache skips parsing and transforming the xdt file if it hasn't changed
+    if not use_cache:
+        return process_xdt(xdt_path, mappings)
+    with profiling.stage("cache load"):
+        key = rowcache.get_key(xdt_path)
+        tables = rowcache.load(xdt_path, key)
+    if tables is not None:
+        print(f"Loaded rows from {rowcache.get_cache_path(xdt_path)}")
+        return tables
+    tables = process_xdt(xdt_path, mappings)
+    try:
+        with profiling.stage("cache save"):
+            rowcache.save(xdt_path, tables, key)
+    except (OSError, ValueError) as e:
+        print(f"Could not cache rows: {e}")
+    return tables
+
+def load_tables(cursor, tables, bulk=False):
+    return [upload_table(cursor, *table, bulk=bulk) for table in tqdm(tables, desc="Uploading")]
+
+def main(conn, xdt_path, bulk=False, use_cache=True):
+    mappings = load_mappings()
+    tables = get_tables(xdt_path, mappings, use_cache)
+    cursor = conn.cursor()
+    if bulk:
+        with bulk_load_session(cursor):
+            stats = load_tables(cursor, tables, bulk=True)
+    else:
+        stats = load_tables(cursor, tables)
+    print_stats(stats)
     finalize(cursor)
     conn.commit()
 
 def connect_to_db():
+    # imported here so the table processing can be used without a MySQL driver
+    import mysql.connector
     return mysql.connector.connect(
         host="localhost",
         user="root",
@@ -207,13 +339,16 @@ def finalize(cursor):
 
 # %%
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 json2xdb.py <path to xdt file>")
-        sys.exit(1)
-    xdt_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Populates an XDB tabledata server from xdt.json.")
+    parser.add_argument("xdt_path", help="path to xdt file")
+    parser.add_argument("--bulk", action="store_true", help="load each table in one transaction with key and constraint checks off, building indexes afterwards")
+    parser.add_argument("--no-cache", action="store_true", help="reprocess the xdt file even if it has a cache, and don't write one")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start("json2xdb", args)
     prep_db()
     conn = connect_to_db()
-    main(conn, xdt_path)
+    main(conn, args.xdt_path, args.bulk, not args.no_cache)
     conn.close()
 
 # %%
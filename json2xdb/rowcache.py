@@ -0,0 +1,225 @@
+# %%
+# Binary cache of the rows json2xdb uploads
+#
+# Parsing xdt.json and running every entry through the schemas takes most of
+# a json2xdb run, and gives the same rows every time for the same input. They
+# are saved to <xdt file>.cache, which later runs memory-map instead.
+#
+# The file starts with a JSON header describing each DB table, followed by
+# its columns as typed arrays: 64-bit ints, doubles, or indices into a shared
+# pool of UTF-8 strings. Columns that hold anything else store their values
+# JSON-encoded in the pool. The header records a key hashing the input file,
+# mappings.json, the schemas and json2xdb.py itself; if any of them changed,
+# the cache is ignored and rebuilt.
+import os
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+
+MAGIC = b"XDBROWS\0"
+FORMAT_VERSION = 1
+ALIGN = 8
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def get_cache_path(xdt_path):
+    return xdt_path + ".cache"
+
+def hash_file(h, path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+def get_key(xdt_path):
+    h = hashlib.sha256(f"{FORMAT_VERSION}".encode())
+    hash_file(h, xdt_path)
+    hash_file(h, os.path.join(here, "mappings.json"))
+    for fn in sorted(os.listdir(os.path.join(here, "schema"))):
+        h.update(fn.encode())
+        hash_file(h, os.path.join(here, "schema", fn))
+    hash_file(h, os.path.join(here, "json2xdb.py"))
+    return h.hexdigest()
+
+# %%
+def get_column_type(values):
+    # bools are ints to Python, but not to the DB
+    types = {type(val) for val in values}
+    if types == {int} and all(-2 ** 63 <= val < 2 ** 63 for val in values):
+        return "q"
+    if types == {float}:
+        return "d"
+    if types == {str}:
+        return "s"
+    return "j"
+
+class StringPool:
+    def __init__(self):
+        self.indices = {}
+
+    def add(self, s):
+        return self.indices.setdefault(s, len(self.indices))
+
+    def to_arrays(self):
+        blob = bytearray()
+        offsets = array("q", [0])
+        for s in self.indices:
+            blob += s.encode("utf-8")
+            offsets.append(len(blob))
+        return (offsets, bytes(blob))
+
+def save(xdt_path, tables, key=None):
+    """
+    Writes tables, a list of (DB table name, field names, rows), to the cache
+    of xdt_path. Every row of a table must have one value per field.
+    """
+    if key is None:
+        key = get_key(xdt_path)
+    pool = StringPool()
+    sections = []
+    header_tables = []
+    for db_table_name, field_names, rows in tables:
+        if any(len(row) != len(field_names) for row in rows):
+            raise ValueError(f"rows of {db_table_name} don't all have the same fields")
+        columns = []
+        for i, values in enumerate(zip(*rows)):
+            kind = get_column_type(values)
+            if kind == "s":
+                data = array("q", [pool.add(val) for val in values])
+            elif kind == "j":
+                data = array("q", [pool.add(json.dumps(val)) for val in values])
+            else:
+                data = array(kind, values)
+            columns.append({"name": field_names[i], "type": kind, "section": len(sections)})
+            sections.append(data.tobytes())
+        header_tables.append({"name": db_table_name, "rows": len(rows), "columns": columns})
+
+    (offsets, blob) = pool.to_arrays()
+    pool_offsets = len(sections)
+    sections.append(offsets.tobytes())
+    sections.append(blob)
+
+    # sections are laid out after the header, each aligned for its type
+    layout = []
+    pos = 0
+    for section in sections:
+        pos += -pos % ALIGN
+        layout.append((pos, len(section)))
+        pos += len(section)
+    header = {"key": key, "tables": header_tables, "sections": layout, "pool": pool_offsets}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    data_start = len(MAGIC) + 8 + len(header_bytes)
+    data_start += -data_start % ALIGN
+
+    path = get_cache_path(xdt_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for (offset, _), section in zip(layout, sections):
+            f.seek(data_start + offset)
+            f.write(section)
+    os.replace(tmp_path, path)
+
+# %%
+class CacheReader:
+    """
+    A memory-mapped cache file. Tables are only decoded when asked for, int
+    and float columns as arrays copied straight from the mapping.
+    """
+    def __init__(self, path, key):
+        self.mm = None
+        self.tables = {}
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = self.read_header()
+        except ValueError:
+            header = None
+        if header is None or header["key"] != key:
+            self.close()
+            raise ValueError(f"{path} is not a cache for this input")
+        self.sections = header["sections"]
+        self.pool = header["pool"]
+        self.tables = {table["name"]: table for table in header["tables"]}
+        self.strings = None
+
+    def read_header(self):
+        if self.mm[:len(MAGIC)] != MAGIC:
+            return None
+        (header_len,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self.mm[start:start + header_len])
+        self.data_start = start + header_len + (-(start + header_len) % ALIGN)
+        return header
+
+    def section(self, i, fmt=None):
+        offset, length = self.sections[i]
+        start = self.data_start + offset
+        view = memoryview(self.mm)[start:start + length]
+        return view if fmt is None else view.cast(fmt)
+
+    def get_strings(self):
+        # the pool is only decoded once, however many columns use it
+        if self.strings is None:
+            offsets = self.section(self.pool, "q").tolist()
+            start = self.data_start + self.sections[self.pool + 1][0]
+            blob = self.mm[start:start + offsets[-1]]
+            self.strings = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        return self.strings
+
+    def read_columns(self, name):
+        """Returns the field names of a table and its columns, in the same order."""
+        table = self.tables[name]
+        columns = []
+        for column in table["columns"]:
+            kind = column["type"]
+            if kind == "s":
+                strings = self.get_strings()
+                columns.append([strings[i] for i in self.section(column["section"], "q")])
+            elif kind == "j":
+                strings = self.get_strings()
+                columns.append([json.loads(strings[i]) for i in self.section(column["section"], "q")])
+            else:
+                data = array(kind)
+                data.frombytes(self.section(column["section"]))
+                columns.append(data)
+        return ([column["name"] for column in table["columns"]], columns)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+def open_cache(xdt_path, key=None):
+    """Returns a CacheReader for xdt_path, or None if there is no cache or it is out of date."""
+    path = get_cache_path(xdt_path)
+    if not os.path.isfile(path):
+        return None
+    if key is None:
+        key = get_key(xdt_path)
+    try:
+        return CacheReader(path, key)
+    except ValueError:
+        return None
+
+def load(xdt_path, key=None):
+    """
+    Returns the tables cached for xdt_path, like save() took them, or None if
+    there is no cache or it is out of date.
+    """
+    reader = open_cache(xdt_path, key)
+    if reader is None:
+        return None
+    try:
+        tables = []
+        for name, table in reader.tables.items():
+            (field_names, columns) = reader.read_columns(name)
+            columns = [column.tolist() if isinstance(column, array) else column for column in columns]
+            rows = list(zip(*columns)) if columns else [() for _ in range(table["rows"])]
+            tables.append((name, field_names, rows))
+        return tables
+    finally:
+        reader.close()
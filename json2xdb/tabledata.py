@@ -0,0 +1,119 @@
+# %%
+# Read-only, in-memory access to the tabledata, without a database
+#
+# Tables hold the same rows json2xdb uploads, under the same DB table and
+# column names, read from the row cache next to the xdt file (which is built
+# first if needed). A table is only loaded the first time it's used, and is
+# kept column by column: ints and floats in arrays, strings in lists. Lookups
+# go through hash indexes on the columns in json2xdb.NATURAL_KEYS, or on any
+# other column, built the first time it's searched.
+#
+#   with TableData("xdt.json") as td:
+#       td.npc(2675)["NpcName"]
+#       td.item(ITEM_QUEST, 1)
+#       td.mission(1)
+import rowcache
+from json2xdb import NATURAL_KEYS, get_db_column_name, get_tables, load_mappings
+
+# item types, as used by the game
+ITEM_WEAPON = 0
+ITEM_SHIRTS = 1
+ITEM_PANTS = 2
+ITEM_SHOES = 3
+ITEM_HAT = 4
+ITEM_GLASS = 5
+ITEM_BACK = 6
+ITEM_GENERAL = 7
+ITEM_QUEST = 8
+ITEM_CHEST = 9
+ITEM_VEHICLE = 10
+
+ITEM_TABLES = {
+    ITEM_WEAPON: "ItemWpnTable",
+    ITEM_SHIRTS: "ItemShirtTable",
+    ITEM_PANTS: "ItemPantsTable",
+    ITEM_SHOES: "ItemShoesTable",
+    ITEM_HAT: "ItemHatTable",
+    ITEM_GLASS: "ItemGlassTable",
+    ITEM_BACK: "ItemBackTable",
+    ITEM_GENERAL: "ItemGeneralTable",
+    ITEM_QUEST: "ItemQuestTable",
+    ITEM_CHEST: "ItemChestTable",
+    ITEM_VEHICLE: "ItemVehicleTable",
+}
+
+class Table:
+    def __init__(self, name, field_names, columns):
+        self.name = name
+        self.column_names = [get_db_column_name(field_name) for field_name in field_names]
+        self.columns = dict(zip(self.column_names, columns))
+        self.size = len(columns[0]) if columns else 0
+        self.indexes = {}
+        for column_name in NATURAL_KEYS.get(name, ()):
+            self.index(column_name)
+
+    def __len__(self):
+        return self.size
+
+    def row(self, i):
+        return {name: self.columns[name][i] for name in self.column_names}
+
+    def index(self, column_name):
+        """Returns {value: [row numbers]} for a column, building it if needed."""
+        index = self.indexes.get(column_name)
+        if index is None:
+            index = {}
+            for i, val in enumerate(self.columns[column_name]):
+                index.setdefault(val, []).append(i)
+            self.indexes[column_name] = index
+        return index
+
+    def find(self, column_name, value):
+        """Returns every row where column_name is value."""
+        return [self.row(i) for i in self.index(column_name).get(value, ())]
+
+    def get(self, column_name, value):
+        """Returns the first row where column_name is value, or None."""
+        rows = self.index(column_name).get(value)
+        return self.row(rows[0]) if rows else None
+
+class TableData:
+    def __init__(self, xdt_path):
+        self.xdt_path = xdt_path
+        self.tables = {}
+        self.reader = rowcache.open_cache(xdt_path)
+        if self.reader is None:
+            get_tables(xdt_path, load_mappings())
+            self.reader = rowcache.open_cache(xdt_path)
+        if self.reader is None:
+            raise ValueError(f"Could not cache the rows of {xdt_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+
+    def table_names(self):
+        return list(self.reader.tables)
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            (field_names, columns) = self.reader.read_columns(name)
+            table = Table(name, field_names, columns)
+            self.tables[name] = table
+        return table
+
+    def npc(self, npc_number):
+        return self.table("NpcTable").get("NpcNumber", npc_number)
+
+    def item(self, item_type, item_number):
+        return self.table(ITEM_TABLES[item_type]).get("ItemNumber", item_number)
+
+    def mission(self, mission_id):
+        """Returns the task rows of a mission, in order."""
+        return self.table("MissionField").find("HMissionID", mission_id)
@@ -0,0 +1,193 @@
+# %%
+# The reverse of json2xdb: exports an XDB tabledata server back to xdt.json
+#
+# Every table listed in mappings.json is read with an unbuffered cursor, so
+# rows stream from the server as they are written out, and the JSON is
+# written to disk one entry at a time. Entries are rebuilt by walking the
+# table's schema and its DB columns side by side: padding columns are dropped,
+# numbered columns are gathered back into arrays, interleaved SPLIT_FIELDS
+# columns into their separate arrays, and the CutSceneText rows are grouped
+# back by event.
+#
+# Fields that json2xdb drops (those missing from the schemas) can't be
+# recovered, so only the tables json2xdb uploads are exported. Mapped tables
+# that aren't on the server (e.g. after a partial upload) are skipped and
+# reported.
+import os
+import json
+import argparse
+from tqdm import tqdm
+from json2xdb import SPLIT_FIELDS, here, get_db_column_name, load_mappings, connect_to_db
+
+FETCH_SIZE = 1000 # rows fetched from the server at a time
+
+# %%
+def get_table_names(conn):
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("SHOW TABLES")
+    names = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return names
+
+def get_columns(conn, db_table_name):
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(f"SHOW COLUMNS FROM {db_table_name}")
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return [column for column in columns if column != "id"]
+
+def plan_entry(schema, columns):
+    """
+    Matches the fields of a schema with the DB columns they were flattened
+    into, in order. Returns a list of (field name, column index) for scalars
+    and (field name, [column indices]) for arrays.
+    """
+    plan = []
+    pos = 0
+
+    def take(db_field_name):
+        nonlocal pos
+        if pos < len(columns) and columns[pos] == db_field_name:
+            pos += 1
+            return pos - 1
+        return None
+
+    padding = 0
+    for n, field_name in enumerate(schema):
+        if field_name is None:
+            if take(get_db_column_name(f"m_iPadding{padding}")) is None:
+                raise ValueError(f"Expected padding column {padding} at column {pos}")
+            padding += 1
+            continue
+
+        i = take(get_db_column_name(field_name))
+        if i is not None:
+            plan.append((field_name, i))
+            continue
+
+        if field_name in SPLIT_FIELDS:
+            # columns interleave the split fields, element by element
+            split_field_names = SPLIT_FIELDS[field_name]
+            indices = {split_field_name: [] for split_field_name in split_field_names}
+            while True:
+                k = len(indices[split_field_names[0]])
+                if columns[pos:pos + 1] != [get_db_column_name(f"{split_field_names[0]}{k}")]:
+                    break
+                for split_field_name in split_field_names:
+                    i = take(get_db_column_name(f"{split_field_name}{k}"))
+                    if i is None:
+                        raise ValueError(f"Expected {split_field_name}{k} at column {pos}")
+                    indices[split_field_name].append(i)
+            if len(indices[split_field_names[0]]) > 0:
+                plan.extend(indices.items())
+                continue
+
+        # an array, which stops where the next field starts
+        upcoming = schema[n + 1] if n + 1 < len(schema) else None
+        stop = get_db_column_name(upcoming) if upcoming is not None else None
+        indices = []
+        while pos < len(columns) and columns[pos] != stop:
+            i = take(get_db_column_name(f"{field_name}{len(indices)}"))
+            if i is None:
+                break
+            indices.append(i)
+        if len(indices) > 0:
+            plan.append((field_name, indices))
+        # otherwise json2xdb reported the field as missing and skipped it
+
+    if pos != len(columns):
+        raise ValueError(f"Could not match columns {columns[pos:]} with the schema")
+    return plan
+
+def unflatten_row(plan, row):
+    entry = {}
+    for field_name, i in plan:
+        if type(i) == list:
+            entry[field_name] = [row[j] for j in i]
+        else:
+            entry[field_name] = row[i]
+    return entry
+
+def group_dict_table(entries, identifier_key, items_key):
+    # undoes handle_dict_table for consecutive rows with the same identifier
+    group = None
+    for entry in entries:
+        identifier = entry.pop(identifier_key)
+        if group is None or group[identifier_key] != identifier:
+            if group is not None:
+                yield group
+            group = {identifier_key: identifier, items_key: []}
+        group[items_key].append(entry)
+    if group is not None:
+        yield group
+
+# %%
+def read_table(conn, db_table_name, schema):
+    columns = get_columns(conn, db_table_name)
+    plan = plan_entry(schema, columns)
+    cursor = conn.cursor() # unbuffered: rows are only read as they're fetched
+    select = ", ".join(f"`{column}`" for column in columns)
+    cursor.execute(f"SELECT {select} FROM {db_table_name} ORDER BY id")
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield unflatten_row(plan, row)
+    finally:
+        cursor.close()
+
+def write_entries(f, entries):
+    first = True
+    for entry in entries:
+        f.write("\n" if first else ",\n")
+        f.write("            ")
+        f.write(json.dumps(entry, ensure_ascii=False))
+        first = False
+    f.write("\n        " if not first else "")
+
+def export_xdt_table(conn, f, table_name, subtables):
+    first = True
+    for subtable_name, db_table_name in tqdm(subtables.items(), desc=table_name, total=len(subtables)):
+        with open(os.path.join(here, "schema", f"{db_table_name}.json"), 'r') as sf:
+            schema = json.load(sf)
+
+        f.write("\n" if first else ",\n")
+        f.write(f"        {json.dumps(subtable_name)}: [")
+        entries = read_table(conn, db_table_name, schema)
+        if db_table_name == "CutSceneText":
+            entries = group_dict_table(entries, "m_iEvent", "m_TextElement")
+        write_entries(f, entries)
+        f.write("]")
+        first = False
+
+def main(conn, xdt_path):
+    mappings = load_mappings()
+    existing = get_table_names(conn)
+    missing = []
+    tmp_path = xdt_path + ".tmp"
+    with open(tmp_path, 'w', encoding="utf-8") as f:
+        f.write("{")
+        first = True
+        for table_name, subtables in mappings.items():
+            missing += [db_table_name for db_table_name in subtables.values() if db_table_name not in existing]
+            subtables = {name: db_table_name for name, db_table_name in subtables.items() if db_table_name in existing}
+            f.write("\n" if first else ",\n")
+            f.write(f"    {json.dumps(table_name)}: {{")
+            export_xdt_table(conn, f, table_name, subtables)
+            f.write("\n    }")
+            first = False
+        f.write("\n}\n")
+    os.replace(tmp_path, xdt_path)
+    if missing:
+        print(f"Skipped {len(missing)} tables missing from the server: {', '.join(missing)}")
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports an XDB tabledata server to xdt.json.")
+    parser.add_argument("xdt_path", help="path to write the xdt file to")
+    args = parser.parse_args()
+    conn = connect_to_db()
+    main(conn, args.xdt_path)
+    conn.close()
@@ -0,0 +1,184 @@
+# Profiling and timing hooks shared by the scripts in this collection
+#
+# Scripts wrap their phases in named stages:
+#
+#   with profiling.stage("parse"):
+#       ...
+#
+# Stages only add up how many times they ran and for how long, so they're
+# cheap enough to leave in. They may nest and may be entered from several
+# threads at once. Work done elsewhere can be reported with profiling.add(),
+# and worker processes can send their stages back with take_stages() for the
+# parent to merge().
+#
+# Nothing is written unless asked for, on the command line of scripts that
+# call add_arguments(), or through the environment:
+#
+#   --profile PATH / SCRIPTS_PROFILE=PATH    cProfile the run and dump its stats
+#                                            to PATH, for pstats or snakeviz, with
+#                                            the top functions printed to stderr
+#   --timings PATH / SCRIPTS_TIMINGS=PATH    write the stage timers to PATH as
+#                                            JSON when the process exits
+#
+# "{pid}" in either path is replaced with the process ID, for servers running
+# several worker processes. cProfile only sees the thread that called start(),
+# so servers pass per_request=True instead and wrap their request handlers in
+# profile_request(), which profiles each request on its own thread and merges
+# them into one profile.
+
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+
+PROFILE_ENV = 'SCRIPTS_PROFILE'
+TIMINGS_ENV = 'SCRIPTS_TIMINGS'
+TOP_FUNCTIONS = 25 # functions printed to stderr when profiling
+
+lock = threading.Lock()
+stages = {}
+state = {'name': None, 'started': None, 'start': None, 'profiler': None, 'per_request': False, 'requests': None}
+
+def add(name, seconds):
+    """Adds a run of stage `name` that took `seconds`."""
+    with lock:
+        entry = stages.get(name)
+        if entry is None:
+            entry = stages[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+
+@contextmanager
+def stage(name):
+    """Times the block as a run of stage `name`. Also works as a decorator."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+def merge(other):
+    """Adds the stages `other`, as returned by take_stages(), to this process's."""
+    with lock:
+        for name, other_entry in other.items():
+            entry = stages.get(name)
+            if entry is None:
+                entry = stages[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            entry['count'] += other_entry['count']
+            entry['total'] += other_entry['total']
+            entry['max'] = max(entry['max'], other_entry['max'])
+
+def get_stages():
+    with lock:
+        return {name: dict(entry) for name, entry in stages.items()}
+
+def take_stages():
+    """The stages so far, which are then reset, for a worker to send back."""
+    with lock:
+        taken = {name: dict(entry) for name, entry in stages.items()}
+        stages.clear()
+    return taken
+
+def report():
+    """The timing report written at exit, as a dict."""
+    now = time.perf_counter()
+    return {
+        'script': state['name'],
+        'argv': sys.argv,
+        'pid': os.getpid(),
+        'started': state['started'],
+        'wall': now - state['start'] if state['start'] is not None else None,
+        'stages': get_stages(),
+    }
+
+def add_arguments(parser):
+    parser.add_argument('--profile', metavar='PATH', default=os.environ.get(PROFILE_ENV),
+        help='profile the run with cProfile and write the stats to PATH (default: ${})'.format(PROFILE_ENV))
+    parser.add_argument('--timings', metavar='PATH', default=os.environ.get(TIMINGS_ENV),
+        help='write a JSON report of the time spent in each stage to PATH at exit (default: ${})'.format(TIMINGS_ENV))
+
+def get_path(path):
+    return path.replace('{pid}', str(os.getpid())) if path else None
+
+@contextmanager
+def profile_request():
+    """
+    Profiles the block, when the run is profiled with per_request=True, and
+    adds it to the run's profile. Also works as a decorator.
+    """
+    profiler = cProfile.Profile() if state['per_request'] else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # since Python 3.12 only one profiler can be active at a time, so
+            # requests overlapping a profiled one go unprofiled
+            profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            with lock:
+                if state['requests'] is None:
+                    state['requests'] = pstats.Stats(profiler, stream=sys.stderr)
+                else:
+                    state['requests'].add(profiler)
+
+def start(name, args=None, per_request=False):
+    """
+    Starts timing the run of script `name`. The output paths come from the
+    --profile and --timings arguments if `args` is given, and the environment
+    otherwise. With per_request, only the blocks in profile_request() are
+    profiled.
+    """
+    if args is not None:
+        profile_path = getattr(args, 'profile', None)
+        timings_path = getattr(args, 'timings', None)
+    else:
+        profile_path = os.environ.get(PROFILE_ENV)
+        timings_path = os.environ.get(TIMINGS_ENV)
+
+    state['name'] = name
+    state['started'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    state['start'] = time.perf_counter()
+
+    if profile_path and per_request:
+        state['per_request'] = True
+    elif profile_path:
+        state['profiler'] = cProfile.Profile()
+        state['profiler'].enable()
+    atexit.register(finish, profile_path, timings_path)
+
+def finish(profile_path, timings_path):
+    if timings_path:
+        path = get_path(timings_path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    stats = None
+    profiler = state['profiler']
+    if profiler is not None:
+        profiler.disable()
+        state['profiler'] = None
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+    elif state['per_request']:
+        state['per_request'] = False
+        with lock:
+            stats = state['requests']
+        if stats is None:
+            print('no requests were profiled', file=sys.stderr)
+
+    if stats is not None:
+        path = get_path(profile_path)
+        stats.dump_stats(path)
+        print('profile of {} written to {}'.format(state['name'], path), file=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
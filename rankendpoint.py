@@ -6,13 +6,45 @@
 # Example invocation in production (behind a properly configured gateway like nginx):
 # $ RANKENDPOINT_DBPATH=/path/to/database.db RANKENDPOINT_ROUTE=/getranks uwsgi \
 #     -s localhost:3031 --manage-script-name --mount /=rankendpoint:app --plugin python3
+#
+# Set RANKENDPOINT_CREATE_INDEXES=1 to have the endpoint add the indexes its queries
+# use to the database on startup (the only time it ever writes to it).
+#
+# Set RANKENDPOINT_SNAPSHOTDIR to a writable directory to serve queries from a snapshot of
+# the database instead, so leaderboard traffic never contends with the game server's
+# writes. Each process refreshes its snapshot every RANKENDPOINT_SNAPSHOT_INTERVAL seconds
+# (default 60) on a background thread, copying the database a batch of pages at a time so
+# the game server can still commit while it runs. Every commit restarts the copy, so a
+# refresh that hasn't finished after RANKENDPOINT_SNAPSHOT_TIMEOUT seconds (default 120)
+# is abandoned and counted as failed. Replaced snapshots are deleted once the last request
+# reading them is done.
+# The snapshot can be up to an interval (plus the time a refresh takes) behind the
+# database, so a score the server just recorded may not show up, or move the player's
+# rank, until the next refresh.
+# If the snapshot gets older than RANKENDPOINT_SNAPSHOT_MAX_STALENESS seconds (default
+# 300), because refreshing keeps failing, queries go to the database directly until
+# a refresh succeeds.
+#
+# Player names are cached in memory and fully reloaded every
+# RANKENDPOINT_NAMES_REFRESH_INTERVAL seconds (default 600) to pick up renames.
+#
+# GET {RANKENDPOINT_ROUTE}/stats reports how fresh the snapshot is, how long a refresh in
+# progress has been running (so a stalled one shows), how many leaderboard queries were
+# answered by joining an identical one already in progress, and the time spent in each
+# stage of serving requests. Set SCRIPTS_PROFILE and/or SCRIPTS_TIMINGS
+# to write a cProfile dump of the leaderboard requests and/or those timings when the
+# process exits (see profiling.py; put {pid} in the paths when running several workers).
 
-from flask import Flask, request
+from flask import Flask, request, g
 app = Flask(__name__)
 
 import sqlite3
 import sys
 import os
+import time
+import atexit
+import threading
+import profiling
 
 header = "SUCCESS"
 
@@ -22,6 +54,8 @@ route = os.environ.get('RANKENDPOINT_ROUTE')
 if None in (db_path, route):
     sys.exit('must set RANKENDPOINT_DBPATH and RANKENDPOINT_ROUTE environment variables')
 
+profiling.start('rankendpoint', per_request=True)
+
 # Opens database in read-only mode
 # Checking same thread disabled for now, which is fine since we never modify anything
 try:
@@ -31,14 +65,317 @@ except Exception as ex:
     print(ex)
     sys.exit()
 
+# Lets the rank lookups count better scores without scanning every result
+if os.environ.get('RANKENDPOINT_CREATE_INDEXES') == '1':
+    try:
+        rwdb = sqlite3.connect(db_path)
+        rwdb.execute('CREATE INDEX IF NOT EXISTS RaceResults_EPID_Score ON RaceResults (EPID, Score);')
+        rwdb.commit()
+        rwdb.close()
+    except Exception as ex:
+        print(ex)
+        sys.exit()
+
 #db.set_trace_callback(print)
 
-def fetch_ranks(epid, date, num):
+class Snapshot:
+    # A copy of the database, deleted once it has been replaced and the last request
+    # reading from it is done
+    def __init__(self, path, taken):
+        self.path = path
+        self.taken = taken
+        self.conn = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True, check_same_thread=False)
+        self.users = 0
+        self.retired = False
+
+    def close(self):
+        self.conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class Snapshots:
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.current = None
+        self.retired = [] # replaced, but still being read from
+        self.count = 0
+        self.pid = None
+        self.refreshes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.restarts = 0 # backups started over because the database was written to
+        self.refresh_started = None
+        self.last_duration = None
+
+    def path(self, n):
+        # per process, since every uwsgi worker keeps its own snapshot
+        return os.path.join(self.directory, 'rankendpoint-{}-{}.db'.format(self.pid, n))
+
+    def start(self):
+        # threads don't survive forking, so this runs in each worker on first use
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.current = None
+        self.retired = []
+        atexit.register(self.cleanup)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def refresh(self):
+        taken = time.time()
+        self.refresh_started = taken
+        self.count += 1
+        path = self.path(self.count)
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            # SQLite starts the copy over whenever another connection writes to the
+            # database, so under steady writes it might never finish on its own
+            nonlocal last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                self.restarts += 1
+            last_remaining = remaining
+            if time.time() - taken > snapshot_backup_timeout:
+                self.timeouts += 1
+                raise TimeoutError('snapshot not done after {} seconds'.format(snapshot_backup_timeout))
+
+        src = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)
+        dst = sqlite3.connect(path)
+        try:
+            try:
+                with profiling.stage('backup'):
+                    # a batch of pages at a time, so the game server can commit in between
+                    src.backup(dst, pages=snapshot_backup_pages, progress=progress, sleep=snapshot_backup_sleep)
+            finally:
+                dst.close()
+                src.close()
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            self.refresh_started = None
+
+        snapshot = Snapshot(path, taken)
+        with self.lock:
+            old = self.current
+            self.current = snapshot
+            if old is not None:
+                old.retired = True
+                if old.users == 0:
+                    old.close()
+                else:
+                    self.retired.append(old)
+        self.last_duration = time.time() - taken
+        self.refreshes += 1
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as ex:
+                self.failures += 1
+                print(ex)
+            time.sleep(self.interval)
+
+    def acquire(self, max_staleness):
+        # The current snapshot, if it's fresh enough, which stays open until released
+        with self.lock:
+            current = self.current
+            if current is None or time.time() - current.taken > max_staleness:
+                return None
+            current.users += 1
+            return current
+
+    def release(self, snapshot):
+        with self.lock:
+            snapshot.users -= 1
+            if snapshot.retired and snapshot.users == 0:
+                self.retired.remove(snapshot)
+                snapshot.close()
+
+    def cleanup(self):
+        with self.lock:
+            for snapshot in self.retired + [self.current]:
+                if snapshot is not None:
+                    snapshot.close()
+
+    def get_refresh_running(self):
+        # how long the refresh in progress has been going, if there is one
+        started = self.refresh_started
+        return None if started is None else time.time() - started
+
+    def get_age(self):
+        current = self.current
+        return None if current is None else time.time() - current.taken
+
+snapshot_dir = os.environ.get('RANKENDPOINT_SNAPSHOTDIR')
+snapshot_max_staleness = float(os.environ.get('RANKENDPOINT_SNAPSHOT_MAX_STALENESS', '300'))
+snapshot_backup_pages = 1024 # pages copied per step while taking a snapshot
+snapshot_backup_sleep = 0.05 # seconds to wait before retrying a step that found the database locked
+snapshot_backup_timeout = float(os.environ.get('RANKENDPOINT_SNAPSHOT_TIMEOUT', '120'))
+snapshots = None
+stale_reads = 0
+
+if snapshot_dir is not None:
+    snapshots = Snapshots(snapshot_dir, float(os.environ.get('RANKENDPOINT_SNAPSHOT_INTERVAL', '60')))
+
+def get_db():
+    # The connection to serve a request from: the snapshot if there's a fresh one.
+    # The snapshot is held until the request is torn down, so a refresh can't close it
+    # while it's being read from
+    global stale_reads
+    if snapshots is None:
+        return db
+
+    snapshots.start()
+    snapshot = snapshots.acquire(snapshot_max_staleness)
+    if snapshot is None:
+        stale_reads += 1
+        return db
+
+    g.snapshot = snapshot
+    return snapshot.conn
+
+@app.teardown_request
+def release_snapshot(exc):
+    snapshot = g.pop('snapshot', None)
+    if snapshot is not None:
+        snapshots.release(snapshot)
+
+class SingleFlight:
+    # Concurrent calls with the same key wait for the first one and share its result
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        with self.lock:
+            self.requests += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlight.Call()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = func(*args)
+            except Exception as ex:
+                call.error = ex
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+class PlayerNames:
+    # PlayerID -> (FirstName, LastName), so the ranking queries don't need to join Players.
+    # New players are picked up as they show up in results; a periodic full reload
+    # catches renames and deletions.
+    def __init__(self, refresh_interval):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock() # one query against Players at a time
+        self.names = {}
+        self.absent = set() # players with results but no longer in Players, until the next reload
+        self.max_id = 0
+        self.refresh_interval = refresh_interval
+        self.refreshed = 0
+        self.full_refreshes = 0
+        self.new_player_refreshes = 0
+
+    def full_refresh(self, conn):
+        cur = conn.execute('SELECT PlayerID, FirstName, LastName FROM Players;')
+        names = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        with self.lock:
+            self.names = names
+            self.absent = set()
+            self.max_id = max(names, default=0)
+            self.refreshed = time.time()
+            self.full_refreshes += 1
+
+    def add_new_players(self, conn, ids):
+        # Looks the players up by ID, since nothing guarantees that PlayerIDs are never
+        # reused below the highest one seen, and picks up any newer players on the way
+        with self.lock:
+            max_id = self.max_id
+        ids = sorted(ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            sql = 'SELECT PlayerID, FirstName, LastName FROM Players WHERE PlayerID > ? OR PlayerID IN ({});'
+            cur = conn.execute(sql.format(', '.join('?' * len(chunk))), (max_id, *chunk))
+            rows += cur.fetchall()
+        with self.lock:
+            for row in rows:
+                self.names[row[0]] = (row[1], row[2])
+                self.max_id = max(self.max_id, row[0])
+            self.absent.update(pid for pid in ids if pid not in self.names)
+            self.new_player_refreshes += 1
+
+    def resolve(self, conn, rows):
+        # (PlayerID, Score) rows -> (PlayerID, FirstName, LastName, Score), dropping
+        # players that don't exist, like an INNER JOIN would
+        if time.time() - self.refreshed > self.refresh_interval and self.refresh_lock.acquire(blocking=False):
+            # one request reloads; the others carry on with the names they have
+            try:
+                self.full_refresh(conn)
+            finally:
+                self.refresh_lock.release()
+
+        missing = {row[0] for row in rows if row[0] not in self.names and row[0] not in self.absent}
+        if len(missing) > 0:
+            with self.refresh_lock:
+                with self.lock:
+                    # another request may have looked them up in the meantime
+                    missing = {pid for pid in missing if pid not in self.names and pid not in self.absent}
+                if len(missing) > 0:
+                    self.add_new_players(conn, missing)
+
+        names = self.names
+        return [(row[0], *names[row[0]], row[1]) for row in rows if row[0] in names]
+
+player_names = PlayerNames(float(os.environ.get('RANKENDPOINT_NAMES_REFRESH_INTERVAL', '600')))
+try:
+    player_names.full_refresh(db)
+except Exception as ex:
+    print(ex)
+    sys.exit()
+
+# When a race finishes, everyone in the zone asks for the same leaderboards at once
+ranks_flight = SingleFlight()
+
+def fetch_ranks_coalesced(conn, epid, date, num):
+    # Only requests reading the same snapshot (or all reading the live DB) share a query,
+    # so the board agrees with the request's own my* rows. The connection stays open
+    # while the query is in flight, so its id can't be reused in the meantime
+    return ranks_flight.do((id(conn), epid, date, num), fetch_ranks, conn, epid, date, num)
+
+# Compares the timestamp against a constant, so that the condition can use an index
+after_date = "Timestamp > CAST(STRFTIME('%s', 'now', ?) AS INTEGER)"
+
+@profiling.stage('ranks query')
+def fetch_ranks(conn, epid, date, num):
     sql = """
         SELECT
             PBRaceResults.PlayerID,
-            Players.FirstName,
-            Players.LastName,
             PBRaceResults.Score
         FROM (
             SELECT
@@ -51,54 +388,86 @@ def fetch_ranks(epid, date, num):
                 ) AS PersonalOrder,
                 RaceResults.*
             FROM RaceResults
-            WHERE EPID=? AND DATETIME(Timestamp, 'unixepoch') > DATETIME('now', ?)
+            WHERE EPID=? AND {}
         ) AS PBRaceResults
-        INNER JOIN Players ON PBRaceResults.PlayerID=Players.PlayerID AND PBRaceResults.PersonalOrder=1
+        WHERE PBRaceResults.PersonalOrder=1
         ORDER BY
             PBRaceResults.Score DESC,
             PBRaceResults.RingCount DESC,
             PBRaceResults.Time ASC
-        """
+        """.format(after_date)
 
     if num > -1:
-        sql += "LIMIT ?"
-        args = (epid, date, num)
-    else:
-        args = (epid, date)
+        cur = conn.execute(sql + "LIMIT ?;", (epid, date, num))
+        rows = cur.fetchall()
+        ranks = player_names.resolve(conn, rows)
+        if len(ranks) == len(rows):
+            return ranks
 
-    cur = db.execute(sql + ";", args)
-    rows = cur.fetchall()
+    # Either there's no limit, or some of the top players no longer exist and we need
+    # to read past them
+    cur = conn.execute(sql + ";", (epid, date))
+    ranks = []
+    while num < 0 or len(ranks) < num:
+        rows = cur.fetchmany(100)
+        if len(rows) == 0:
+            break
+        ranks += player_names.resolve(conn, rows)
 
-    return rows
+    return ranks if num < 0 else ranks[:num]
 
-def fetch_my_ranks(pcuid, epid, date):
+@profiling.stage('my ranks query')
+def fetch_my_ranks(conn, pcuid, epid, date):
     sql = """
         SELECT
             RaceResults.PlayerID,
-            Players.FirstName,
-            Players.LastName,
             RaceResults.Score
         FROM RaceResults
-        INNER JOIN Players ON RaceResults.PlayerID=Players.PlayerID
-        WHERE RaceResults.PlayerID=? AND EPID=? AND DATETIME(Timestamp, 'unixepoch') > DATETIME('now', ?)
+        WHERE RaceResults.PlayerID=? AND EPID=? AND {}
         ORDER BY RaceResults.Score DESC
         LIMIT 1;
-        """
+        """.format(after_date)
 
     args = (pcuid, epid, date)
-    cur = db.execute(sql, args)
-    rows = cur.fetchall()
+    cur = conn.execute(sql, args)
+    rows = player_names.resolve(conn, cur.fetchall())
+
+    if len(rows) == 0:
+        return rows, 1
+
+    return rows, fetch_rank(conn, epid, date, rows[0][3])
+
+def fetch_rank(conn, epid, date, score):
+    # Ranked like get_score_entries ranks the boards: tied personal bests share a
+    # rank and the next one follows on (1, 1, 2), so this is one plus the number of
+    # distinct personal bests above this score. Players that no longer exist are left
+    # out, since the boards drop them too. Only the results above this score are read,
+    # through the (EPID, Score) index, but all of those are.
+    sql = """
+        SELECT COUNT(DISTINCT Best)
+        FROM (
+            SELECT MAX(Score) AS Best
+            FROM RaceResults
+            WHERE EPID=? AND Score > ? AND {}
+                AND PlayerID IN (SELECT PlayerID FROM Players)
+            GROUP BY PlayerID
+        );
+        """.format(after_date)
+
+    args = (epid, score, date)
+    cur = conn.execute(sql, args)
+    (better,) = cur.fetchone()
 
-    return rows
+    return better + 1
 
-def get_score_entries(data, name):
+def get_score_entries(data, name, first_rank=1):
     # Uncomment if you want placeholders in top 10 ranks ala Retro
     #if not name.startswith("my"):
     #    while len(data) < 10:
     #        data.append(((999, 'hehe', 'dong', 1)))
 
     scores="<{}>\n".format(name)
-    rank = 1
+    rank = first_rank
     last_score = -1
     for item in data:
         score = item[3]
@@ -113,6 +482,8 @@ def get_score_entries(data, name):
 
 # route should be something like /getranks
 @app.route(f'{route}', methods=['POST'])
+@profiling.profile_request()
+@profiling.stage('request')
 def rankings():
     #print("PCUID:", request.form['PCUID'])
     #print("EP_ID:", request.form['EP_ID'])
@@ -132,26 +503,58 @@ def rankings():
         return "Invalid EP_ID", 400
 
     # Get everything we need from the DB...
-    myday = fetch_my_ranks(pcuid, epid, '-1 day')
-    day = fetch_ranks(epid, '-1 day', num)
-    myweek = fetch_my_ranks(pcuid, epid, '-7 day')
-    week = fetch_ranks(epid, '-7 day', num)
-    mymonth = fetch_my_ranks(pcuid, epid, '-1 month')
-    month = fetch_ranks(epid, '-1 month', num)
-    myalltime = fetch_my_ranks(pcuid, epid, '-999 year')
-    alltime = fetch_ranks(epid, '-999 year', num)
+    # (all from the same connection, so a snapshot swap can't mix two versions)
+    conn = get_db()
+    myday, mydayrank = fetch_my_ranks(conn, pcuid, epid, '-1 day')
+    day = fetch_ranks_coalesced(conn, epid, '-1 day', num)
+    myweek, myweekrank = fetch_my_ranks(conn, pcuid, epid, '-7 day')
+    week = fetch_ranks_coalesced(conn, epid, '-7 day', num)
+    mymonth, mymonthrank = fetch_my_ranks(conn, pcuid, epid, '-1 month')
+    month = fetch_ranks_coalesced(conn, epid, '-1 month', num)
+    myalltime, myalltimerank = fetch_my_ranks(conn, pcuid, epid, '-999 year')
+    alltime = fetch_ranks_coalesced(conn, epid, '-999 year', num)
 
     # Slap that all into an "xml"...
     xmlbody = ""
-    xmlbody += get_score_entries(myday, "myday")
+    xmlbody += get_score_entries(myday, "myday", mydayrank)
     xmlbody += get_score_entries(day, "day")
-    xmlbody += get_score_entries(myweek, "myweek")
+    xmlbody += get_score_entries(myweek, "myweek", myweekrank)
     xmlbody += get_score_entries(week, "week")
-    xmlbody += get_score_entries(mymonth, "mymonth")
+    xmlbody += get_score_entries(mymonth, "mymonth", mymonthrank)
     xmlbody += get_score_entries(month, "month")
-    xmlbody += get_score_entries(myalltime, "myalltime")
+    xmlbody += get_score_entries(myalltime, "myalltime", myalltimerank)
     xmlbody += get_score_entries(alltime, "alltime")
 
     # and send it off!
     return header + xmlbody
 
+
+@app.route(f'{route}/stats', methods=['GET'])
+def stats():
+    result = {
+        'rank_queries': ranks_flight.requests,
+        'coalesced_rank_queries': ranks_flight.coalesced,
+        'players': len(player_names.names),
+        'player_full_refreshes': player_names.full_refreshes,
+        'player_new_refreshes': player_names.new_player_refreshes,
+        'stages': profiling.get_stages(),
+        'snapshots': snapshots is not None,
+    }
+
+    if snapshots is not None:
+        snapshots.start()
+        result.update({
+            'interval': snapshots.interval,
+            'max_staleness': snapshot_max_staleness,
+            'age': snapshots.get_age(),
+            'refreshes': snapshots.refreshes,
+            'failures': snapshots.failures,
+            'timeouts': snapshots.timeouts,
+            'backup_restarts': snapshots.restarts,
+            'refresh_running_for': snapshots.get_refresh_running(),
+            'last_refresh_duration': snapshots.last_duration,
+            'retired_in_use': len(snapshots.retired),
+            'stale_reads': stale_reads,
+        })
+
+    return result
@@ -1,19 +1,26 @@
 from unitypackff.asset import Asset
 from unitypackff.environment import UnityEnvironment
+from concurrent.futures import Future, ThreadPoolExecutor
 import bpy
-import bmesh
 import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
 
-dongpath = (os.path.expandvars('%userprofile%') + "/AppData/LocalLow/Unity/Web Player/Cache/FusionFall")
-env = UnityEnvironment(base_path=dongpath)
-outpath = (os.path.expandvars('%userprofile%') + "/3D Objects/FFTerrainMeshes")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import terrain_mesh
+import ExtractTerrainMeshesHeadless as headless
 
-def uvs_from_vert(uv_layer, v):
-    uvs = []
-    for l in v.link_loops:
-        uv_data = l[uv_layer]
-        uvs.append(uv_data.uv)
-    return uvs
+# Run with: blender -b --python ExtractTerrainMeshes.py -- -i <cache folder> -o <output folder>
+#
+# Bundles are found and skipped when unchanged the same way as in
+# ExtractTerrainMeshesHeadless.py, with the same kind of manifest. bpy only works
+# in the Blender process that loaded it, so -j N runs up to N background Blender
+# processes with one bundle each rather than a process pool.
+
+env = None
 
 def delete_all_objects():
     for i in bpy.context.scene.objects:
@@ -21,134 +28,113 @@ def delete_all_objects():
 
     bpy.ops.object.delete() 
 
-def rip_terrain_mesh(f, outpath, clear=False):
+    # the chunk meshes are left behind by their objects
+    for mesh in bpy.data.meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+def add_chunk_mesh(chunk):
+    # every chunk shares the same local triangles, so the loops only need
+    # the chunk's own 9x9 vertices; no operators involved
+    mesh = bpy.data.meshes.new(chunk.name)
+    mesh.from_pydata(chunk.co.tolist(), [], chunk.tris.tolist())
+    uv_layer = mesh.uv_layers.new()
+    uv_layer.data.foreach_set("uv", chunk.uv[chunk.tris].ravel())
+    mesh.update()
+
+    obj = bpy.data.objects.new(chunk.name, mesh)
+    bpy.context.collection.objects.link(obj)
+    return obj
+
+def rip_terrain_mesh(f, outpath, clear=False, lods=headless.lods):
+    """Exports every TerrainData in an asset bundle. Returns {path ID: [file names]}."""
     dong = Asset.from_file(f, environment=env)
 
+    exported = {}
     for k, v in dong.objects.items():
         if v.type == 'TerrainData':
             terrainData = dong.objects[k].read()
-            terrain_width = terrainData['m_Heightmap']['m_Width'] - 1
-            terrain_height = terrainData['m_Heightmap']['m_Height'] - 1
-            scale_x = terrainData['m_Heightmap']['m_Scale']['x']
-            scale_z = terrainData['m_Heightmap']['m_Scale']['z']
-            scale_y = terrainData['m_Heightmap']['m_Scale']['y']
-
-            # create the terrain
-            bpy.ops.mesh.primitive_grid_add(x_subdivisions=terrain_width, y_subdivisions=terrain_height, size=128, enter_editmode=True, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-            context = bpy.context
-            grid = context.edit_object
-
-            bpy.ops.object.mode_set(mode='EDIT')
-            bm = bmesh.from_edit_mesh(context.edit_object.data)
-            bm.verts.ensure_lookup_table()
-            for index, height in enumerate(terrainData['m_Heightmap']['m_Heights']):
-                # scale height
-                height_norm = height / (2 ** 15 - 2)
-                bm.verts[index].co.z = height_norm * scale_y
-                # pivot and scale x
-                bm.verts[index].co.x += terrain_width / 2
-                bm.verts[index].co.x *= scale_x
-                # pivot and scale z
-                bm.verts[index].co.y += terrain_height / 2
-                bm.verts[index].co.y *= scale_z
-                #print(f"{bm.verts[index].co.x}, {bm.verts[index].co.y}, {bm.verts[index].co.z}")
-
-            indices = []
-            shift_amt = abs(bm.verts[0].co.x - bm.verts[1].co.x)
-            uv_layer = bm.loops.layers.uv.active
-            uv_shift_amt = 1 / 256
-            # gather m_Shifts positions
-            for shift in terrainData['m_Heightmap']['m_Shifts']:
-                shift_index = shift['y'] + shift['x'] * 129
-                indices.append(shift_index)
-                v = bm.verts[shift_index]
-                flags = shift['flags'] # bits: +X -X +Y -Y
-                if flags & 0b1000: # +X
-                    v.co.x += shift_amt
-                    for uv in uvs_from_vert(uv_layer, v):
-                        uv.x += uv_shift_amt
-                if flags & 0b0100: # -X
-                    v.co.x -= shift_amt
-                    for uv in uvs_from_vert(uv_layer, v):
-                        uv.x -= uv_shift_amt
-                if flags & 0b0010: # +Y
-                    v.co.y += shift_amt
-                    for uv in uvs_from_vert(uv_layer, v):
-                        uv.y += uv_shift_amt
-                if flags & 0b0001: # -Y
-                    v.co.y -= shift_amt
-                    for uv in uvs_from_vert(uv_layer, v):
-                        uv.y -= uv_shift_amt
-
-            # apply triangulate modifier
-            mod = grid.modifiers.new("Triangulate", 'TRIANGULATE')
-            mod.quad_method = 'FIXED' # triangle orientation
-            bpy.ops.object.mode_set(mode='OBJECT')
-            bpy.ops.object.modifier_apply(modifier="Triangulate")
-
-            bpy.ops.object.mode_set(mode="EDIT")
-            bm = bmesh.from_edit_mesh(context.edit_object.data)
-            bm.verts.ensure_lookup_table()
-
-            # flip diagonally
-            for v in bm.verts:
-                tmp = v.co.x
-                v.co.x = v.co.y
-                v.co.y = tmp
-
-            # flip normals
-            for f in bm.faces:
-                f.normal_flip()
-
-            # select vertex chunks and separate
-            verts = {}
-            for x in range(129):
-                for y in range(129):
-                    idx = y + x * 129
-                    v = bm.verts[idx]
-                    verts[idx] = v
-                    v.select = False
-                    for f in v.link_faces:
-                        f.select = False
-            chunk_size = 8
-            for x in range(128 // chunk_size):
-                for y in range(128 // chunk_size):
-                    for i in range(x * chunk_size, x * chunk_size + chunk_size + 1):
-                        for j in range(y * chunk_size, y * chunk_size + chunk_size + 1):
-                            idx = j + i * 129
-                            v = verts[idx]
-                            v.select = True
-                    bm.select_mode = {'VERT', 'EDGE', 'FACE'}
-                    bm.select_flush_mode()
-                    bpy.context.tool_settings.mesh_select_mode = (False, False, True)
-                    bpy.ops.mesh.duplicate()
-                    bpy.ops.mesh.separate(type='SELECTED')
-                    bpy.ops.mesh.select_all(action='DESELECT')
-
-            # delete main
-            bpy.ops.object.mode_set(mode="OBJECT")
-            bpy.ops.object.select_all(action='DESELECT')
-            grid.select_set(True)
-            bpy.ops.object.delete()
-
-            # export
-            bpy.ops.object.select_all(action='SELECT')
+
+            # heights, m_Shifts, triangulation, diagonal flip and LOD levels are
+            # all computed by terrain_mesh, then each chunk becomes its own object
             name = terrainData['m_Name']
-            outfile = f"{name}.fbx"
-            bpy.ops.export_scene.fbx(filepath=os.path.join(outpath, outfile))
-            
+            exported[str(k)] = []
+            for level, chunks in enumerate(terrain_mesh.build_levels(terrainData['m_Heightmap'], lods)):
+                bpy.ops.object.select_all(action='DESELECT')
+                for chunk in chunks:
+                    add_chunk_mesh(chunk).select_set(True)
+
+                # export, one file per level
+                suffix = f"_lod{level}" if level > 0 else ""
+                outfile = f"{name}{suffix}.fbx"
+                bpy.ops.export_scene.fbx(filepath=os.path.join(outpath, outfile), use_selection=True)
+                exported[str(k)].append(outfile)
+
             if(clear):
                 delete_all_objects()
-
-dongs = os.listdir(dongpath)
-for dongname in dongs:
-    if not dongname.endswith("resourceFile"):
-        continue
-    assets = os.listdir(os.path.join(dongpath, dongname))
-    for assetname in assets:
-        if not assetname.startswith("CustomAssetBundle"):
-            continue
-        with open(os.path.join(dongpath, dongname, assetname), "rb") as f:
-            outdir = os.path.join(outpath, dongname, assetname)
-            os.makedirs(outdir, exist_ok=True)
-            rip_terrain_mesh(f, outdir, True)
+    return exported
+
+def extract_bundle(bundle, inpath, outpath, lods):
+    outdir = os.path.join(outpath, bundle)
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(inpath, bundle), "rb") as f:
+        return rip_terrain_mesh(f, outdir, True, lods)
+
+def extract_in_blender(bundle, args):
+    # extracts one bundle in a background Blender, which writes what it exported to a file
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        cmd = [bpy.app.binary_path, "-b", "--factory-startup", "--python-exit-code", "1",
+            "--python", os.path.abspath(__file__), "--",
+            "-i", args.input, "-o", args.output, "--lods", str(args.lods),
+            "--bundle", bundle, "--result", result_path]
+        # the error, if any, is on its stderr
+        returncode = subprocess.run(cmd, stdout=subprocess.DEVNULL).returncode
+        if returncode != 0:
+            raise RuntimeError(f"background Blender exited with status {returncode}")
+        with open(result_path, "r") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+def extract_here(bundle, args):
+    # extracts one bundle in this Blender, as an already finished future
+    future = Future()
+    try:
+        future.set_result(extract_bundle(bundle, args.input, args.output, args.lods))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def parse_args():
+    # Blender's own arguments come before the "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="blender -b --python ExtractTerrainMeshes.py --",
+        description="Extracts the TerrainData meshes of every asset bundle in the FusionFall web player cache as FBX files.")
+    parser.add_argument("-i", "--input", default=headless.dongpath, help=f"cache folder containing the *resourceFile folders (default: {headless.dongpath})".replace("%", "%%"))
+    parser.add_argument("-o", "--output", default=headless.outpath, help=f"where to write the meshes (default: {headless.outpath})".replace("%", "%%"))
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="number of background Blender processes; 0 uses every core, 1 extracts in this Blender instead (default: 0)")
+    parser.add_argument("--lods", type=int, default=headless.lods, choices=range(len(terrain_mesh.lod_steps) + 1),
+        help=f"number of reduced LOD levels to export besides the full mesh (default: {headless.lods})")
+    parser.add_argument("--force", action="store_true", help="extract every bundle, even unchanged ones")
+    # used by extract_in_blender
+    parser.add_argument("--bundle", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+args = parse_args()
+env = UnityEnvironment(base_path=args.input)
+if args.bundle is not None:
+    objects = extract_bundle(args.bundle, args.input, args.output, args.lods)
+    with open(args.result, "w") as f:
+        json.dump(objects, f)
+else:
+    os.makedirs(args.output, exist_ok=True)
+    manifest = headless.Manifest(args.output, ("fbx",), args.lods)
+    if args.jobs == 1:
+        headless.extract_changed(args.input, manifest, args.force, lambda bundle: extract_here(bundle, args))
+    else:
+        with ThreadPoolExecutor(max_workers=args.jobs or os.cpu_count()) as executor:
+            headless.extract_changed(args.input, manifest, args.force,
+                lambda bundle: executor.submit(extract_in_blender, bundle, args))
@@ -0,0 +1,169 @@
+from unitypackff.asset import Asset
+from unitypackff.environment import UnityEnvironment
+from concurrent.futures import ProcessPoolExecutor
+import os
+import json
+import hashlib
+import argparse
+import terrain_mesh
+
+# Same as ExtractTerrainMeshes.py, without Blender: the chunk meshes are built
+# with NumPy and written as glTF (.glb) and/or OBJ files. Each LOD level of
+# the chunks goes to its own file, named after the terrain with a _lod{level}
+# suffix.
+#
+# Asset bundles are extracted in parallel. What was exported is recorded in a
+# manifest at the root of the output folder, keyed by the hash of each bundle
+# and the path IDs of its TerrainData objects, so re-runs skip bundles that
+# haven't changed since their meshes were written.
+
+MANIFEST_NAME = ".terrain_manifest.json"
+MANIFEST_VERSION = 1
+
+# the home folder is %userprofile% on Windows, where the cache usually is
+home = os.path.expanduser("~")
+dongpath = os.path.join(home, "AppData", "LocalLow", "Unity", "Web Player", "Cache", "FusionFall")
+outpath = os.path.join(home, "3D Objects", "FFTerrainMeshes")
+formats = ("glb",)
+lods = len(terrain_mesh.lod_steps)
+
+env = None
+
+def init_worker(inpath):
+    global env
+    env = UnityEnvironment(base_path=inpath)
+
+def rip_terrain_mesh(f, outpath, env, formats=formats, lods=lods):
+    """Exports every TerrainData in an asset bundle. Returns {path ID: [file names]}."""
+    dong = Asset.from_file(f, environment=env)
+
+    exported = {}
+    for k, v in dong.objects.items():
+        if v.type == 'TerrainData':
+            terrainData = dong.objects[k].read()
+            levels = terrain_mesh.build_levels(terrainData['m_Heightmap'], lods)
+
+            # export
+            name = terrainData['m_Name']
+            exported[str(k)] = []
+            for level, chunks in enumerate(levels):
+                suffix = f"_lod{level}" if level > 0 else ""
+                for fmt in formats:
+                    outfile = f"{name}{suffix}.{fmt}"
+                    terrain_mesh.writers[fmt](os.path.join(outpath, outfile), chunks)
+                    exported[str(k)].append(outfile)
+    return exported
+
+def extract_bundle(bundle, inpath, outpath, formats, lods):
+    # runs in the worker processes
+    outdir = os.path.join(outpath, bundle)
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(inpath, bundle), "rb") as f:
+        return rip_terrain_mesh(f, outdir, env, formats, lods)
+
+def find_bundles(inpath):
+    bundles = []
+    for dongname in sorted(os.listdir(inpath)):
+        if not dongname.endswith("resourceFile"):
+            continue
+        for assetname in sorted(os.listdir(os.path.join(inpath, dongname))):
+            if assetname.startswith("CustomAssetBundle"):
+                bundles.append(os.path.join(dongname, assetname))
+    return bundles
+
+def get_settings_digest(formats, lods):
+    # a change to the mesh builder, the formats or the LOD levels invalidates every entry
+    h = hashlib.sha256(f"{','.join(formats)};{lods}".encode())
+    with open(terrain_mesh.__file__, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Manifest:
+    def __init__(self, outpath, formats, lods):
+        self.path = os.path.join(outpath, MANIFEST_NAME)
+        self.outpath = outpath
+        self.settings = get_settings_digest(formats, lods)
+        self.bundles = {}
+
+        try:
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("settings") == self.settings:
+            self.bundles = manifest["bundles"]
+
+    def is_current(self, bundle, digest):
+        entry = self.bundles.get(bundle)
+        if entry is None or entry["hash"] != digest:
+            return False
+        # the meshes may have been deleted since
+        return all(os.path.isfile(os.path.join(self.outpath, bundle, outfile))
+            for outfiles in entry["objects"].values() for outfile in outfiles)
+
+    def update(self, bundle, digest, objects):
+        self.bundles[bundle] = {"hash": digest, "objects": objects}
+
+    def save(self):
+        manifest = {"version": MANIFEST_VERSION, "settings": self.settings, "bundles": self.bundles}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+def extract_changed(inpath, manifest, force, submit):
+    """
+    Extracts the bundles that changed since the manifest was written.
+    submit(bundle) starts extracting one and returns a future of what
+    rip_terrain_mesh returned for it.
+    """
+    todo = {}
+    skipped = 0
+    for bundle in find_bundles(inpath):
+        digest = hash_file(os.path.join(inpath, bundle))
+        if not force and manifest.is_current(bundle, digest):
+            skipped += 1
+        else:
+            todo[bundle] = digest
+
+    failed = 0
+    try:
+        futures = {bundle: submit(bundle) for bundle in todo}
+        for bundle, future in futures.items():
+            try:
+                objects = future.result()
+            except Exception as e:
+                print(f"Failed to extract {bundle}: {e}")
+                failed += 1
+                continue
+            manifest.update(bundle, todo[bundle], objects)
+            print(f"Extracted {len(objects)} terrains from {bundle}")
+    finally:
+        manifest.save()
+    print(f"{len(todo) - failed} extracted, {failed} failed, {skipped} unchanged")
+
+def extract_all(inpath, outpath, formats=formats, jobs=None, force=False, lods=lods):
+    os.makedirs(outpath, exist_ok=True)
+    manifest = Manifest(outpath, formats, lods)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(inpath,)) as executor:
+        extract_changed(inpath, manifest, force,
+            lambda bundle: executor.submit(extract_bundle, bundle, inpath, outpath, formats, lods))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracts the TerrainData meshes of every asset bundle in the FusionFall web player cache, without Blender.")
+    parser.add_argument("-i", "--input", default=dongpath, help=f"cache folder containing the *resourceFile folders (default: {dongpath})".replace("%", "%%"))
+    parser.add_argument("-o", "--output", default=outpath, help=f"where to write the meshes (default: {outpath})".replace("%", "%%"))
+    parser.add_argument("-f", "--format", action="append", choices=sorted(terrain_mesh.writers), help=f"output format, can be repeated (default: {formats[0]})")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="number of worker processes; 0 uses every core (default: 0)")
+    parser.add_argument("--lods", type=int, default=lods, choices=range(len(terrain_mesh.lod_steps) + 1),
+        help=f"number of reduced LOD levels to export besides the full mesh (default: {lods})")
+    parser.add_argument("--force", action="store_true", help="extract every bundle, even unchanged ones")
+    args = parser.parse_args()
+    extract_all(args.input, args.output, tuple(args.format or formats), args.jobs or None, args.force, args.lods)
@@ -0,0 +1,272 @@
+import json
+import struct
+import functools
+import numpy as np
+
+# Builds the same meshes as ExtractTerrainMeshes.py from a TerrainData
+# heightmap, with NumPy only, and writes them as OBJ or binary glTF.
+#
+# Vertex i of the grid sits at column i % width and row i // width. The
+# positions are flipped diagonally like in Blender (x is the row, y the column
+# and z the height), the UVs are not. Each quad is split along its first
+# diagonal, as by Blender's FIXED triangulation.
+#
+# Each chunk can also be decimated into lighter LOD levels, keeping only every
+# 2nd, 4th or 8th row and column inside it (see lod_mesh). The vertices on the
+# chunk's border are always kept, so chunks of any level meet without cracks.
+
+chunk_size = 8
+uv_shift_amt = 1 / 256
+height_norm = 2 ** 15 - 2
+lod_steps = (2, 4, 8) # grid step of LOD levels 1, 2 and 3
+
+class Chunk:
+    def __init__(self, name, co, uv, tris):
+        self.name = name
+        self.co = co # (n, 3) float32, Z up
+        self.uv = uv # (n, 2) float32
+        self.tris = tris # (m, 3) uint32, counter-clockwise seen from +Z
+
+def build_grid(heightmap):
+    """Returns the positions and UVs of every heightmap vertex, with m_Shifts applied."""
+    width = heightmap['m_Width']
+    height = heightmap['m_Height']
+    scale = heightmap['m_Scale']
+
+    rows, cols = np.divmod(np.arange(width * height), width)
+    heights = np.asarray(heightmap['m_Heights'], dtype=np.float32)
+    co = np.empty((width * height, 3), dtype=np.float32)
+    co[:, 0] = cols * scale['x']
+    co[:, 1] = rows * scale['z']
+    co[:, 2] = heights / height_norm * scale['y']
+    uv = np.empty((width * height, 2), dtype=np.float32)
+    uv[:, 0] = cols / (width - 1)
+    uv[:, 1] = rows / (height - 1)
+
+    # bits: +X -X +Y -Y; the shift is one column wide in both directions
+    shifts = heightmap['m_Shifts']
+    indices = np.array([shift['y'] + shift['x'] * width for shift in shifts], dtype=np.intp)
+    flags = np.array([shift['flags'] for shift in shifts], dtype=np.intp)
+    dx = ((flags >> 3) & 1) - ((flags >> 2) & 1)
+    dy = ((flags >> 1) & 1) - (flags & 1)
+    np.add.at(co[:, 0], indices, dx * scale['x'])
+    np.add.at(co[:, 1], indices, dy * scale['x'])
+    np.add.at(uv[:, 0], indices, dx * uv_shift_amt)
+    np.add.at(uv[:, 1], indices, dy * uv_shift_amt)
+
+    # flip diagonally
+    co[:, [0, 1]] = co[:, [1, 0]]
+    return (co, uv)
+
+def shifted_vertices(heightmap):
+    """Returns a mask of the grid vertices moved by m_Shifts."""
+    width = heightmap['m_Width']
+    shifted = np.zeros(width * heightmap['m_Height'], dtype=bool)
+    for shift in heightmap['m_Shifts']:
+        if shift['flags'] & 0xf:
+            shifted[shift['y'] + shift['x'] * width] = True
+    return shifted
+
+def grid_triangles(rows, cols):
+    """Triangles of a grid of rows x cols vertices, as indices into it."""
+    r, c = np.divmod(np.arange((rows - 1) * (cols - 1)), cols - 1)
+    v0 = r * cols + c
+    v1 = v0 + 1
+    v2 = v0 + cols + 1
+    v3 = v0 + cols
+    # the winding is reversed twice, by the flip and by flipping the normals
+    tris = np.empty((len(v0), 2, 3), dtype=np.uint32)
+    tris[:, 0] = np.stack([v0, v2, v1], axis=1)
+    tris[:, 1] = np.stack([v0, v3, v2], axis=1)
+    return tris.reshape(-1, 3)
+
+def chunk_vertices(width, row, col, size=chunk_size):
+    """Grid indices of the (size + 1)^2 vertices of the chunk starting at row, col."""
+    r, c = np.divmod(np.arange((size + 1) ** 2), size + 1)
+    return (row + r) * width + col + c
+
+def split_chunks(co, uv, width, height, size=chunk_size):
+    """
+    Splits the grid into size x size quad chunks, named like the objects
+    Blender separates them into. Every chunk shares the same local triangles;
+    only the vertices they index differ.
+    """
+    tris = grid_triangles(size + 1, size + 1)
+    chunks = []
+    for row in range(0, height - 1, size):
+        for col in range(0, width - 1, size):
+            verts = chunk_vertices(width, row, col, size)
+            name = "Grid.{:03}".format(len(chunks) + 1)
+            chunks.append(Chunk(name, co[verts], uv[verts], tris))
+    return chunks
+
+@functools.lru_cache(maxsize=None)
+def lod_mesh(size, step):
+    """
+    Decimates a chunk of size x size quads to every step-th row and column.
+    Returns the indices of the chunk vertices it keeps, the triangles as
+    indices into those, and a mask of the kept vertices.
+
+    Cells of step x step quads away from the chunk border are split in two
+    like the quads of the full grid. Cells along it keep all their border
+    vertices and are fanned from their center vertex instead, so the border
+    matches the full mesh (and any other level) exactly.
+    """
+    n = size + 1
+    if step == 1:
+        return (np.arange(n * n), grid_triangles(n, n), np.ones(n * n, dtype=bool))
+    if size % step or step % 2:
+        raise ValueError(f"LOD step {step} must be even and divide the chunk size {size}")
+
+    def ring_side(r, c, dr, dc, on_border):
+        # the vertices of a cell side, without its last corner
+        return [(r + dr * i, c + dc * i) for i in (range(step) if on_border else (0,))]
+
+    tris = []
+    for r0 in range(0, size, step):
+        for c0 in range(0, size, step):
+            r1, c1 = r0 + step, c0 + step
+            if 0 < r0 and r1 < size and 0 < c0 and c1 < size:
+                tris.append([(r0, c0), (r1, c1), (r0, c1)])
+                tris.append([(r0, c0), (r1, c0), (r1, c1)])
+                continue
+            ring = (ring_side(r0, c0, 0, 1, r0 == 0) + ring_side(r0, c1, 1, 0, c1 == size)
+                + ring_side(r1, c1, 0, -1, r1 == size) + ring_side(r1, c0, -1, 0, c0 == 0))
+            center = (r0 + step // 2, c0 + step // 2)
+            tris.extend([center, ring[i], ring[(i + 1) % len(ring)]] for i in range(len(ring)))
+
+    rc = np.array(tris, dtype=np.intp) # (m, 3, [row, col])
+    # wind them all like grid_triangles does
+    (a, b, c) = (rc[:, 0], rc[:, 1], rc[:, 2])
+    cross = (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]) - (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1])
+    rc[cross > 0, 1:] = rc[cross > 0, :0:-1]
+    local = rc[:, :, 0] * n + rc[:, :, 1]
+
+    keep = np.unique(local)
+    remap = np.zeros(n * n, dtype=np.uint32)
+    remap[keep] = np.arange(len(keep))
+    kept = np.zeros(n * n, dtype=bool)
+    kept[keep] = True
+    return (keep, remap[local], kept)
+
+def get_lod_step(shifted, step, size=chunk_size):
+    """
+    The coarsest step, up to `step`, that keeps every shifted vertex of a
+    chunk, given its mask of them. Halving the step keeps more vertices.
+    """
+    while step > 1 and not np.all(lod_mesh(size, step)[2][shifted]):
+        step //= 2
+    return step
+
+def split_lod_chunks(co, uv, shifted, width, height, level, size=chunk_size):
+    """
+    Like split_chunks, at LOD level `level` (1 for lod_steps[0], and so on).
+    The chunks are named after the full ones, with a _lod{level} suffix.
+    Chunks with shifted vertices their level would drop are decimated less.
+    """
+    chunks = []
+    for row in range(0, height - 1, size):
+        for col in range(0, width - 1, size):
+            verts = chunk_vertices(width, row, col, size)
+            step = get_lod_step(shifted[verts], lod_steps[level - 1], size)
+            (keep, tris, _) = lod_mesh(size, step)
+            name = "Grid.{:03}_lod{}".format(len(chunks) + 1, level)
+            chunks.append(Chunk(name, co[verts[keep]], uv[verts[keep]], tris))
+    return chunks
+
+def build_chunks(heightmap):
+    (co, uv) = build_grid(heightmap)
+    return split_chunks(co, uv, heightmap['m_Width'], heightmap['m_Height'])
+
+def build_levels(heightmap, levels=len(lod_steps)):
+    """Returns the chunks of the full mesh, followed by those of each LOD level up to `levels`."""
+    (co, uv) = build_grid(heightmap)
+    width = heightmap['m_Width']
+    height = heightmap['m_Height']
+    result = [split_chunks(co, uv, width, height)]
+    if levels > 0:
+        shifted = shifted_vertices(heightmap)
+        for level in range(1, levels + 1):
+            result.append(split_lod_chunks(co, uv, shifted, width, height, level))
+    return result
+
+def to_y_up(co):
+    # like Blender's exporters: Z up becomes Y up, Y forward becomes -Z
+    return np.stack([co[:, 0], co[:, 2], -co[:, 1]], axis=1).astype(np.float32)
+
+def write_obj(path, chunks):
+    lines = []
+    base = 1
+    for chunk in chunks:
+        lines.append("o {}".format(chunk.name))
+        lines.extend("v {:.6f} {:.6f} {:.6f}".format(*v) for v in to_y_up(chunk.co).tolist())
+        lines.extend("vt {:.6f} {:.6f}".format(*t) for t in chunk.uv.tolist())
+        lines.extend("f {0}/{0} {1}/{1} {2}/{2}".format(*f) for f in (chunk.tris + base).tolist())
+        base += len(chunk.co)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def write_glb(path, chunks):
+    buf = bytearray()
+    views = []
+    accessors = []
+    index_accessors = {}
+
+    def add_accessor(data, kind, target, min_max=False):
+        while len(buf) % 4:
+            buf.append(0)
+        views.append({"buffer": 0, "byteOffset": len(buf), "byteLength": data.nbytes, "target": target})
+        buf.extend(data.tobytes())
+        accessor = {
+            "bufferView": len(views) - 1,
+            "componentType": 5126 if data.dtype == np.float32 else 5125,
+            "count": len(data),
+            "type": kind,
+        }
+        if min_max:
+            accessor["min"] = data.min(axis=0).tolist()
+            accessor["max"] = data.max(axis=0).tolist()
+        accessors.append(accessor)
+        return len(accessors) - 1
+
+    meshes = []
+    nodes = []
+    for chunk in chunks:
+        position = add_accessor(to_y_up(chunk.co), "VEC3", 34962, min_max=True)
+        # glTF UVs start at the top left
+        uv = np.stack([chunk.uv[:, 0], 1 - chunk.uv[:, 1]], axis=1).astype(np.float32)
+        texcoord = add_accessor(uv, "VEC2", 34962)
+        # chunks sharing their triangles share the index accessor too
+        key = chunk.tris.tobytes()
+        if key not in index_accessors:
+            index_accessors[key] = add_accessor(chunk.tris.astype(np.uint32).ravel(), "SCALAR", 34963)
+        meshes.append({"name": chunk.name, "primitives": [{
+            "attributes": {"POSITION": position, "TEXCOORD_0": texcoord},
+            "indices": index_accessors[key],
+        }]})
+        nodes.append({"name": chunk.name, "mesh": len(meshes) - 1})
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "terrain_mesh_extractor"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(nodes)))}],
+        "nodes": nodes,
+        "meshes": meshes,
+        "accessors": accessors,
+        "bufferViews": views,
+        "buffers": [{"byteLength": len(buf)}],
+    }
+    js = json.dumps(gltf, separators=(",", ":")).encode()
+    js += b" " * (-len(js) % 4)
+    buf.extend(b"\0" * (-len(buf) % 4))
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(js) + 8 + len(buf)))
+        f.write(struct.pack("<I4s", len(js), b"JSON"))
+        f.write(js)
+        f.write(struct.pack("<I4s", len(buf), b"BIN\0"))
+        f.write(buf)
+
+writers = {
+    "obj": write_obj,
+    "glb": write_glb,
+}